@@ -1,16 +1,71 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pytube import YouTube
+from fastapi.responses import JSONResponse
+import asyncio
+import contextlib
+import hmac
+import math
 import os
+import uuid
 import yt_dlp
 from pydantic import BaseModel
+from typing import List, Optional
 import assemblyai as aai
 from mangum import Mangum
+from metadata import MetadataCache, parse_video_id
+from limits import AdmissionController, RateLimited, RouteLimits
+from scheduler import JobScheduler
+from transcription import WEBHOOK_AUTH_HEADER, TranscriptionClient
+import audio
+import compact
+import realtime
+from transcript_index import TranscriptIndex
+import store
+from store import TranscriptStore
+from buffers import AudioBuffer, BufferBudget
+from shared import SharedCache
+from serialization import TranscriptResponse, plain
+import prefetch
+import profiling
 
 class URL(BaseModel):
     url: str
+    trim_silence: bool = False  # cut silent stretches before transcribing
+    compact_audio: bool = False  # re-encode to mono 16 kHz Opus while uploading
+    start: Optional[float] = None  # seconds into the video to start transcribing at
+    end: Optional[float] = None  # seconds into the video to stop at; timestamps stay in video time
 
-app = FastAPI()
+class SearchQuery(BaseModel):
+    query: str
+    limit: int = 20
+
+class EntityQuery(BaseModel):
+    text: str
+    entity_type: Optional[str] = None  # e.g. person_name, organization, location
+    limit: int = 20
+
+class TranscriptWebhook(BaseModel):
+    transcript_id: str
+    status: str
+
+class PrefetchRequest(BaseModel):
+    urls: List[str] = []
+    channels: List[str] = []  # channel URLs; their latest uploads are prefetched
+    per_channel: int = 5
+    transcribe: bool = True  # False only warms metadata and the player
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # The videos warmed while the handler initialized are transcribed once the event loop
+    # runs. Mangum runs this on every invocation, so they are only queued the first time.
+    global warm_up_urls
+    if warm_up_urls and os.getenv('PREFETCH_TRANSCRIBE', '1') == '1':
+        prefetcher.submit(warm_up_urls)
+    warm_up_urls = []
+    yield
+
+app = FastAPI(lifespan=lifespan)
 handler = Mangum(app)
 
 origins = ["https://aistudio.contentedai.com",
@@ -22,24 +77,49 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["Content-Type"],
+    allow_headers=["Content-Type", "X-Profile"],
+    expose_headers=["X-Profile-Id", "X-Profile-Hotspots"],
 )
 
 class VideoProcessor:
+    def __init__(self):
+        # Metadata, base.js and in-flight work shared by the worker processes on this host
+        self.shared = SharedCache(os.getenv('SHARED_CACHE_PATH', '/tmp/shared_cache.db'))
+        self.lease_ttl = int(os.getenv('TRANSCRIPTION_LEASE_TTL', '1800'))
+        self.lease_poll_interval = float(os.getenv('TRANSCRIPTION_LEASE_POLL_INTERVAL', '5'))
+        self.metadata = MetadataCache(
+            ttl=int(os.getenv('METADATA_CACHE_TTL', '3600')),
+            shared=self.shared,
+        )
+        # Polls all outstanding transcripts from one task, or waits for webhooks if configured
+        self.transcriber = TranscriptionClient(
+            webhook_url=os.getenv('ASSEMBLYAI_WEBHOOK_URL'),
+            webhook_secret=os.getenv('ASSEMBLYAI_WEBHOOK_SECRET'),
+            first_poll_ratio=float(os.getenv('TRANSCRIPTION_FIRST_POLL_RATIO', '0.1')),
+            shared=self.shared,
+        )
+        # Full-text index of every transcript produced, served by /search
+        self.index = TranscriptIndex(os.getenv('TRANSCRIPT_INDEX_PATH', '/tmp/transcripts.db'))
+        # Uploads and transcripts per video, so repeat requests skip work already done
+        self.store = TranscriptStore(os.getenv('TRANSCRIPT_STORE_PATH', '/tmp/transcripts.db'))
+        # Audio up to AUDIO_BUFFER_MAX_BYTES goes from download to upload in memory, as long as all
+        # buffers together stay under AUDIO_BUFFER_BUDGET_BYTES; larger buffers are memory-mapped
+        self.buffer_budget = BufferBudget(int(os.getenv('AUDIO_BUFFER_BUDGET_BYTES', str(256 * 1024 * 1024))))
+        self.buffer_max_bytes = int(os.getenv('AUDIO_BUFFER_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.buffer_mmap_bytes = int(os.getenv('AUDIO_BUFFER_MMAP_BYTES', str(16 * 1024 * 1024)))
+
+    @profiling.profiled
     def get_info(self, url):
-        try:          
-            yt = YouTube(url)  # Create a YouTube object            
-            video_id = yt.video_id  # Get video ID       
-            video_length = yt.length  # Get video length in seconds
-            return video_id, video_length
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return None, None
+        # Video ID comes from the URL itself; length is looked up once per ID and cached.
+        # Raises ValueError for URLs without a video ID, and lets lookup errors propagate.
+        metadata = self.metadata.lookup(url)
+        return metadata.video_id, metadata.length
 
+    @profiling.profiled
     def save_video(self, url, video_filename):
         # Download the highest resolution video from YouTube given a URL
-        youtube_object = YouTube(url)
-        youtube_object = youtube_object.streams.get_highest_resolution()
+        yt = self.metadata.youtube(url)
+        youtube_object = self.metadata.streams(yt).get_highest_resolution()
 
         # Use /tmp directory for temporary storage
         tmp_directory = '/tmp'
@@ -52,10 +132,11 @@ class VideoProcessor:
             return None
         return os.path.join(tmp_directory, video_filename)
 
+    @profiling.profiled
     def save_audio(self, url):
         # Download the audio stream from a YouTube video and convert it to m4a
-        yt = YouTube(url)
-        video = yt.streams.filter(only_audio=True).first()
+        yt = self.metadata.youtube(url)  # reuses the page fetched by get_info, if any
+        video = self.metadata.streams(yt).filter(only_audio=True).first()
         # Use /tmp directory for temporary storage
         tmp_directory = '/tmp'
         os.makedirs(tmp_directory, exist_ok=True)
@@ -76,6 +157,90 @@ class VideoProcessor:
             return None  # or handle the error as needed
         return new_file_path
     
+    @profiling.profiled
+    def save_audio_buffer(self, url):
+        # Download the audio stream into memory instead of /tmp. Returns None (so the caller
+        # uses save_audio) if the stream is too large, its size is unknown or the budget is spent.
+        yt = self.metadata.youtube(url)
+        video = self.metadata.streams(yt).filter(only_audio=True).first()
+        try:
+            size = video.filesize
+        except Exception as e:
+            print("Error getting audio size:", e)
+            size = 0
+        buffer = None
+        if size <= 0:
+            print("Audio size unknown, downloading to disk")
+        elif size > self.buffer_max_bytes:
+            print(f"Audio too large to buffer, downloading {size} bytes to disk")
+        else:
+            buffer = AudioBuffer.allocate(size, self.buffer_budget, self.buffer_mmap_bytes)
+            if buffer is None:
+                print(f"Audio buffer budget exhausted, downloading {size} bytes to disk")
+        if buffer is None:
+            self.metadata.give_back(yt)  # save_audio reuses the parsed streams
+            return None
+        try:
+            video.stream_to_buffer(buffer)
+        except Exception as e:
+            print("Error during download:", e)
+            buffer.close()
+            return None
+        return buffer
+
+    @profiling.profiled
+    def save_audio_window(self, url, start, end):
+        # Download only start..end seconds of the audio stream. ffmpeg seeks on the stream URL,
+        # so the bytes before the window are skipped rather than downloaded, and copies the audio.
+        yt = self.metadata.youtube(url)
+        stream = self.metadata.streams(yt).filter(only_audio=True).first()
+        tmp_directory = '/tmp'
+        os.makedirs(tmp_directory, exist_ok=True)
+        extension = 'm4a' if stream.subtype == 'mp4' else stream.subtype
+        file_name = os.path.join(tmp_directory, f"{store.window_key(yt.video_id, start, end)}.{extension}")
+        try:
+            audio.cut_window(stream.url, start, end, file_name)
+        except Exception as e:
+            print("Error during window download:", e)
+            return None
+        return file_name
+
+    @profiling.profiled
+    def save_audio_window_yt_dlp(self, url, start, end):
+        # The yt-dlp counterpart of save_audio_window: yt-dlp passes the range to ffmpeg,
+        # which reads only that part of the stream, and the audio is extracted as m4a.
+        tmp_directory = '/tmp'
+        os.makedirs(tmp_directory, exist_ok=True)
+        video_id = parse_video_id(url) or uuid.uuid4().hex
+        file_base = os.path.join(tmp_directory, store.window_key(video_id, start, end))
+        ydl_opts = {
+            'format': 'm4a/bestaudio/best',
+            'outtmpl': file_base + '.%(ext)s',
+            'download_ranges': yt_dlp.utils.download_range_func(
+                None, [(start, float('inf') if end is None else end)]),
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'm4a',
+            }]
+        }
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.download([url])
+        except Exception as e:
+            print("Error during window download:", e)
+            return None
+        file_name = file_base + '.m4a'
+        return file_name if os.path.exists(file_name) else None
+
+    def window_download(self, download):
+        # The download of just a time window that fetches the audio the same way as download
+        if download == self.save_audio:
+            return self.save_audio_window
+        if download in (self.save_audio_yt_dlp, self.save_audio_yt_dlp_local):
+            return self.save_audio_window_yt_dlp
+        raise ValueError("This download does not support a start/end window")
+
+    @profiling.profiled
     def save_audio_yt_dlp(self, youtube_url):
         ydl_opts = {
             'format': 'm4a/bestaudio/best',  
@@ -111,6 +276,7 @@ class VideoProcessor:
             print(f"File not found: {new_file_path}")
             return None
         
+    @profiling.profiled
     def save_audio_yt_dlp_local(self, youtube_url):
         ydl_opts = {
             'format': 'm4a/bestaudio/best',  
@@ -129,6 +295,36 @@ class VideoProcessor:
     
         return file_name
 
+    @profiling.profiled
+    def trim_silence(self, audio_file):
+        # Cut long silences before upload. Returns the file to transcribe and the offset map
+        # that puts transcript timestamps back in video time (None if nothing was cut).
+        try:
+            return audio.trim_silence(audio_file)
+        except Exception as e:
+            print("Error during silence trimming:", e)
+            return audio_file, None
+
+    @profiling.profiled
+    def upload_audio(self, audio_file, compact=False):
+        # Upload a local file or AudioBuffer to AssemblyAI and return its URL. With compact=True
+        # the audio is re-encoded by ffmpeg on the way, streamed straight from its stdout to the upload.
+        transcriber = aai.Transcriber()
+        if isinstance(audio_file, AudioBuffer):
+            source, original = audio_file.view, audio_file.reader
+        else:
+            source, original = audio_file, lambda: audio_file
+        if not compact:
+            return transcriber.upload_file(original())
+        try:
+            with audio.TranscodedStream(source) as stream:
+                upload_url = transcriber.upload_file(stream)
+                print(f"Uploaded {stream.bytes_read} bytes of compact audio")
+            return upload_url
+        except Exception as e:
+            print("Error during compact upload, uploading original:", e)
+            return transcriber.upload_file(original())
+
     def remove_temporary_files(self, file_path):
         # Remove temporary files from the /tmp directory
         try:
@@ -138,30 +334,184 @@ class VideoProcessor:
         except Exception as e:
             print(f"Error removing files: {e}")
 
-    def transcribe(self, audio_file): 
-        transcript = aai.Transcriber().transcribe(audio_file)
+    def transcription_config(self, features):
+        # AssemblyAI options for a set of store features; plain text needs no options
+        options = {}
+        if store.ENTITIES in features:
+            options['entity_detection'] = True
+        if store.SPEAKERS in features:
+            options['speaker_labels'] = True
+        if store.CHAPTERS in features:
+            options['auto_chapters'] = True
+        if store.SUMMARY in features:
+            options['summarization'] = True
+            options['summary_model'] = aai.SummarizationModel.informative
+            options['summary_type'] = aai.SummarizationType.bullets
+        return aai.TranscriptionConfig(**options)
+
+    async def run_transcription(self, audio_file, features, duration=None, offsets=None, video_id=None):
+        # Every new transcript goes through here: wait for it, move timestamps back to video time
+        # if the audio was cut, add it to the search index and remember it for later requests.
+        features = store.feature_set(features)
+        config = self.transcription_config(features)
+        # Only the compact copy is kept, so the SDK's per-word objects are freed right away
+        transcript = compact.CompactTranscript.from_transcript(
+            await self.transcriber.transcribe(audio_file, config, duration)
+        )
+        transcript.remap(offsets)
+        if video_id and transcript.status == aai.TranscriptStatus.completed:
+            segments = offsets.segments if offsets else None
+            try:
+                await asyncio.to_thread(self.store.add_transcript, video_id, transcript.id, features, segments)
+                # Windows are searched under their video's ID, not the window key they are stored under
+                indexed_id = store.window_video(video_id)
+                await asyncio.to_thread(profiling.profiled(self.index.add), indexed_id, transcript,
+                                        indexed_id != video_id)
+            except Exception as e:
+                print(f"Error recording transcript for {video_id}: {e}")
+        return transcript
+
+    async def reuse_transcript(self, video_id, features):
+        # Fetch an earlier transcript of the video that already has every requested feature.
+        # Returns None if there is none, so the caller transcribes from scratch.
+        if not video_id:
+            return None
+        found = await asyncio.to_thread(self.store.find_transcript, video_id, features)
+        if not found:
+            return None
+        transcript_id, segments = found
+        try:
+            transcript = await asyncio.to_thread(aai.Transcript.get_by_id, transcript_id)
+        except Exception as e:
+            print(f"Error fetching stored transcript {transcript_id}: {e}")
+            transcript = None
+        if transcript is None or transcript.status != aai.TranscriptStatus.completed:
+            await asyncio.to_thread(self.store.forget_transcript, transcript_id)
+            return None
+        transcript = compact.CompactTranscript.from_transcript(transcript)
+        transcript.remap(audio.OffsetMap(segments) if segments else None)
+        print(f"Reused transcript {transcript_id} for {video_id}")
+        return transcript
+
+    @contextlib.asynccontextmanager
+    async def lease(self, video_id, features, video_length=None):
+        # Lets one request at a time, across all worker processes, transcribe a video with a
+        # given feature set. Yields None to the request that holds the lease; any other waits
+        # and is handed the holder's transcript once it is stored. If the holder fails, or dies
+        # and its lease expires, a waiter takes the lease over and yields None itself.
+        if not video_id:
+            yield None
+            return
+        key = f"transcribe:{video_id}:{','.join(sorted(store.feature_set(features)))}"
+        owner = uuid.uuid4().hex
+        ttl = self.lease_ttl + (video_length or 0)
+        while not await asyncio.to_thread(self.shared.claim, key, owner, ttl):
+            await asyncio.sleep(self.lease_poll_interval)
+            transcript = await self.reuse_transcript(video_id, features)
+            if transcript is not None:
+                yield transcript
+                return
+        try:
+            yield None
+        finally:
+            await asyncio.to_thread(self.shared.release, key, owner)
+
+    async def analyze(self, url, features, download, duration=None, trim_silence=False,
+                      compact_audio=False, keep_download=False, window=None, reuse_upload=True):
+        # Transcribe the video at url with the given features. Audio uploaded for an earlier
+        # request is transcribed again without downloading or uploading it; otherwise download
+        # (save_audio, save_audio_yt_dlp, ...) fetches it first. A (start, end) window in seconds
+        # is downloaded on its own by the window counterpart of download (see window_download) and
+        # stored under its own key. If a reused upload gives an error transcript (e.g. it expired at
+        # AssemblyAI), it is forgotten and the audio fetched again once, with reuse_upload=False.
+        # Returns the transcript and the local file or upload URL it came from.
+        video_id = store.window_key(parse_video_id(url), *window) if window else parse_video_id(url)
+        # Uploads are only reused by requests that would have preprocessed the audio the same way
+        upload_key = store.upload_key(video_id, trim_silence, compact_audio)
+        upload = None
+        if upload_key and reuse_upload:
+            upload = await asyncio.to_thread(self.store.find_upload, upload_key)
+        buffer = None
+        if not upload and download == self.save_audio and not trim_silence and not window:
+            # Silence trimming needs a file for ffmpeg to scan, so only plain uploads are buffered
+            buffer = await asyncio.to_thread(self.save_audio_buffer, url)
+
+        if upload:
+            upload_url, segments = upload
+            source = upload_url
+        elif buffer is not None:
+            with buffer:
+                upload_url = await asyncio.to_thread(self.upload_audio, buffer, compact_audio)
+            segments = None
+            if upload_key:
+                await asyncio.to_thread(self.store.add_upload, upload_key, upload_url, segments)
+            source = url
+        else:
+            if window:
+                audio_filename = await asyncio.to_thread(self.window_download(download), url, *window)
+            else:
+                audio_filename = await asyncio.to_thread(download, url)
+            if not audio_filename:
+                raise RuntimeError("Failed to download audio.")
+            speech_filename, offsets = audio_filename, None
+            try:
+                if trim_silence:
+                    speech_filename, offsets = await asyncio.to_thread(self.trim_silence, audio_filename)
+                if window:
+                    # The window's audio starts at its start time in the video
+                    start, end = window
+                    if offsets:
+                        offsets = offsets.shift(start)
+                    else:
+                        if end is None:
+                            end = start + await asyncio.to_thread(audio.probe_duration, audio_filename)
+                        offsets = audio.OffsetMap([(start, end)])
+                upload_url = await asyncio.to_thread(self.upload_audio, speech_filename, compact_audio)
+            finally:
+                # The audio lives at AssemblyAI now, so /tmp can be freed before transcription.
+                # Window clips are always removed; keep_download is about whole downloads.
+                if window or not keep_download:
+                    self.remove_temporary_files(audio_filename)
+                if speech_filename != audio_filename:
+                    self.remove_temporary_files(speech_filename)
+            segments = offsets.segments if offsets else None
+            if upload_key:
+                await asyncio.to_thread(self.store.add_upload, upload_key, upload_url, segments)
+            source = audio_filename
+
+        offsets = audio.OffsetMap(segments) if segments else None
+        # A failed transcription may mean the upload expired or was bad, so it is not handed out again
+        try:
+            transcript = await self.run_transcription(upload_url, features, duration, offsets, video_id)
+        except Exception:
+            if upload_key:
+                await asyncio.to_thread(self.store.forget_upload, upload_key)
+            raise
+        if upload_key and transcript.status == aai.TranscriptStatus.error:
+            await asyncio.to_thread(self.store.forget_upload, upload_key)
+            if upload:
+                print(f"Reused upload for {video_id} failed ({transcript.error}); fetching the audio again")
+                return await self.analyze(url, features, download, duration, trim_silence,
+                                          compact_audio, keep_download, window, reuse_upload=False)
+        return transcript, source
+
+    async def transcribe(self, audio_file, duration=None, offsets=None, video_id=None): 
+        transcript = await self.run_transcription(audio_file, [store.TEXT], duration, offsets, video_id)
         return transcript.text
     
-    def auto_chapters(self, audio_file): 
-        config = aai.TranscriptionConfig(auto_chapters=True)
-        transcript = aai.Transcriber().transcribe(audio_file, config)
+    async def auto_chapters(self, audio_file, duration=None, offsets=None, video_id=None): 
+        features = [store.CHAPTERS]
+        transcript = await self.run_transcription(audio_file, features, duration, offsets, video_id)
         return transcript.chapters
     
-    def entity_detection(self, audio_file): 
-        config = aai.TranscriptionConfig(
-            entity_detection=True,
-            speaker_labels=True
-        )
-        transcript = aai.Transcriber().transcribe(audio_file, config)
+    async def entity_detection(self, audio_file, duration=None, offsets=None, video_id=None): 
+        features = [store.ENTITIES, store.SPEAKERS]
+        transcript = await self.run_transcription(audio_file, features, duration, offsets, video_id)
         return transcript
     
-    def summary(self, audio_file): 
-        config = aai.TranscriptionConfig(
-            summarization=True,
-            summary_model=aai.SummarizationModel.informative,
-            summary_type=aai.SummarizationType.bullets
-        )
-        transcript = aai.Transcriber().transcribe(audio_file, config)
+    async def summary(self, audio_file, duration=None, offsets=None, video_id=None): 
+        features = [store.SUMMARY]
+        transcript = await self.run_transcription(audio_file, features, duration, offsets, video_id)
         return transcript.summary
     
     def utterances_list(self, utterance_detection, type):
@@ -195,80 +545,218 @@ class VideoProcessor:
 
 video_processor = VideoProcessor()
 
-@app.get("/")
-async def root():
-    return {"message": "Welcome to YouTube Transcriber API"}
+# Rates are tokens per second; a request costs 1 token plus 1 per started 10 minutes of video.
+# max_concurrent bounds requests admitted to the job scheduler, max_queue how many may wait for that.
+# WORKERS processes (see __main__) each get their share of the limits below, so the totals hold
+# for the whole server. Clients are assumed to be spread evenly across the processes.
+worker_processes = max(1, int(os.getenv('WORKERS', '1')))
 
-@app.post("/process")
-async def process_video(content: URL):
-    # Process a video from a given URL
-    url = content.url
-    if not url:
-        raise HTTPException(status_code=400, detail="Invalid URL")
-    print(url)
+admission = AdmissionController({route: limits.divided(worker_processes) for route, limits in {
+    "process": RouteLimits(rate=0.5, burst=40, client_rate=0.05, client_burst=15, max_concurrent=8, max_queue=8),
+    "detection": RouteLimits(rate=0.5, burst=40, client_rate=0.05, client_burst=15, max_concurrent=8, max_queue=8),
+    "test": RouteLimits(rate=0.5, burst=40, client_rate=0.05, client_burst=15, max_concurrent=8, max_queue=8),
+    "local": RouteLimits(rate=0.5, burst=40, client_rate=0.05, client_burst=15, max_concurrent=4, max_queue=4),
+    "upload": RouteLimits(rate=0.5, burst=20, client_rate=0.1, client_burst=5, max_concurrent=8, max_queue=8),
+    "realtime": RouteLimits(rate=0.5, burst=10, client_rate=0.05, client_burst=3, max_concurrent=4, max_queue=0),
+    "search": RouteLimits(rate=20, burst=100, client_rate=2, client_burst=20, max_concurrent=16, max_queue=64),
+    "info": RouteLimits(rate=20, burst=100, client_rate=2, client_burst=20, max_concurrent=16, max_queue=64),
+    "prefetch": RouteLimits(rate=1, burst=10, client_rate=0.1, client_burst=5, max_concurrent=2, max_queue=8),
+}.items()})
+
+# Any HTTP request with "X-Profile: 1" or "?profile=1" is profiled when PROFILING_ENABLED=1.
+# Its report is kept for PROFILE_TTL seconds under the ID returned in X-Profile-Id. The middleware
+# is only installed then, so requests do not pass through it otherwise.
+profiling_enabled = os.getenv('PROFILING_ENABLED', '0') == '1'
+profile_ttl = int(os.getenv('PROFILE_TTL', '86400'))
+
+async def profile_request(request: Request, call_next):
+    if not profiling.requested(request.headers.get("x-profile"), request.query_params.get("profile")):
+        return await call_next(request)
 
+    with profiling.RequestProfile(f"{request.method} {request.url.path}") as profile:
+        response = await call_next(request)
+    report = profile.report()
     try:
-        audio_filename = video_processor.save_audio(url)
+        # Shared, so GET /profiles/{id} works whichever worker process it reaches
+        await asyncio.to_thread(video_processor.shared.put, "profile", profile.id, report, profile_ttl)
     except Exception as e:
-        error_message = f"Failed to process video. error: {e}"
-        raise HTTPException(status_code=500, detail=error_message)
+        print(f"Error storing profile {profile.id}: {e}")
+    response.headers["X-Profile-Id"] = profile.id
+    response.headers["X-Profile-Hotspots"] = profiling.hot_spots(report)
+    return response
+
+if profiling_enabled:
+    app.middleware("http")(profile_request)
+
+@app.exception_handler(RateLimited)
+async def rate_limited(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Too many requests: {exc.reason}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Worker slots for downloads/AssemblyAI jobs, handed out shortest video first. MAX_CONCURRENT_JOBS
+# is for the whole server and is split across the WORKERS processes.
+scheduler = JobScheduler(
+    workers=max(1, math.ceil(int(os.getenv('MAX_CONCURRENT_JOBS', '4')) / worker_processes)),
+    aging_rate=float(os.getenv('SCHEDULER_AGING_RATE', '10')),
+)
+
+def window_of(content: URL):
+    # The (start, end) seconds requested, or None for the whole video
+    if content.start is None and content.end is None:
+        return None
+    start = content.start or 0.0
+    if start < 0 or (content.end is not None and content.end <= start):
+        raise HTTPException(status_code=400, detail="Invalid start/end window")
+    return start, content.end
+
+def client_id(request):
+    # The caller's address. X-Forwarded-For is never read here, since callers can send any value:
+    # on Lambda Mangum sets the client from API Gateway's sourceIp, and behind a proxy uvicorn
+    # takes it from the header only for the proxies listed in FORWARDED_ALLOW_IPS.
+    return request.client.host if request.client else "unknown"
 
-    if not audio_filename:
-        raise HTTPException(status_code=500, detail="Failed to process video.")
+# Scheduler priority class per client address, e.g. PRIORITY_CLIENTS="10.0.0.5=high,10.0.0.9=low".
+# Everyone else is normal. The class is never taken from the request, which any caller controls.
+client_priorities = {
+    client.strip(): priority.strip().lower()
+    for client, priority in (entry.split("=", 1) for entry in os.getenv('PRIORITY_CLIENTS', '').split(",") if "=" in entry)
+}
 
+def priority_of(request: Request):
+    # The configured class of the caller: high, normal or low
+    return client_priorities.get(client_id(request), "normal")
+
+async def video_length_of(url):
+    # Prices admission and orders the scheduler. The lookup is cached and its page is reused by the download.
+    if not parse_video_id(url):
+        return None
+    try:
+        _, video_length = await run_in_threadpool(video_processor.get_info, url)
+    except Exception as e:
+        print(f"Could not get video length for {url}: {e}")
+        video_length = None
+    return video_length
+
+async def transcribe_video(route, content, request, features, download, keep_download=False):
+    # Shared by the video routes: reuse a transcript that already has the features if there
+    # is one, otherwise queue for a worker slot and transcribe (reusing a stored upload).
+    url = content.url
     api_key = os.getenv('ASSEMBLYAI_API_KEY')
     if not api_key:
         raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
     aai.settings.api_key = api_key 
 
-    transcript = video_processor.entity_detection(audio_filename)
+    window = window_of(content)
+    video_id = store.window_key(parse_video_id(url), *window) if window else parse_video_id(url)
+    transcript = await video_processor.reuse_transcript(video_id, features)
+    if transcript is not None:
+        return transcript, url
+
+    video_length = await video_length_of(url)
+    if window and video_length is not None:
+        # Admission, scheduling and polling go by the audio actually transcribed
+        start, end = window
+        if start >= video_length:
+            raise HTTPException(status_code=400, detail="Window starts after the end of the video")
+        video_length = min(video_length, end if end is not None else video_length) - start
+    async with video_processor.lease(video_id, features, video_length) as transcript:
+        if transcript is not None:
+            return transcript, url
+        async with (
+            admission.admit(route, client_id(request), admission.cost(video_length)),
+            scheduler.slot(video_length, priority_of(request)),
+        ):
+            try:
+                return await video_processor.analyze(
+                    url, features, download, video_length,
+                    trim_silence=content.trim_silence,
+                    compact_audio=content.compact_audio,
+                    keep_download=keep_download,
+                    window=window,
+                )
+            except Exception as e:
+                error_message = f"Failed to process video. error: {e}"
+                raise HTTPException(status_code=500, detail=error_message)
+
+# Every video route is answered by a transcript with these features
+PREFETCH_FEATURES = [store.ENTITIES, store.SPEAKERS]
+
+async def prefetch_video(url):
+    # Transcribe a video into the store ahead of demand, behind every real request
+    api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    if not api_key:
+        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
+    aai.settings.api_key = api_key
+
+    video_id = parse_video_id(url)
+    if await asyncio.to_thread(video_processor.store.find_transcript, video_id, PREFETCH_FEATURES):
+        return
+    video_length = await video_length_of(url)
+    async with video_processor.lease(video_id, PREFETCH_FEATURES, video_length) as transcript:
+        if transcript is not None:
+            return
+        async with scheduler.slot(video_length, "low"):
+            await video_processor.analyze(url, PREFETCH_FEATURES, video_processor.save_audio, video_length)
+
+prefetcher = prefetch.Prefetcher(prefetch_video, workers=int(os.getenv('PREFETCH_WORKERS', '2')))
+
+# Container warm-up: videos in PREFETCH_URLS / PREFETCH_CHANNELS get their metadata and player
+# fetched while the handler initializes, and are transcribed by the lifespan hook above
+warm_up_urls = prefetch.warm_up(video_processor.metadata)
+
+@app.get("/")
+async def root():
+    return {"message": "Welcome to YouTube Transcriber API"}
+
+@app.post("/process")
+async def process_video(content: URL, request: Request):
+    # Process a video from a given URL
+    url = content.url
+    if not url:
+        raise HTTPException(status_code=400, detail="Invalid URL")
+    print(url)
+
+    transcript, source = await transcribe_video(
+        "process", content, request, [store.ENTITIES, store.SPEAKERS], video_processor.save_audio
+    )
     transcript_text = transcript.text
     transcript_entity = transcript.entities
     transcript_utterance = transcript.utterances
   
     response_data = {
-        'video_url': audio_filename,
+        'video_url': source,
         'transcript': transcript_text,
         'entity': transcript_entity,
         'utterance': transcript_utterance
     }
 
-    # Clean up temporary files
-    video_processor.remove_temporary_files(audio_filename)
-
-    return response_data
+    # Tens of thousands of nested word objects; encoded in one pass instead of by jsonable_encoder
+    return TranscriptResponse(response_data)
 
 @app.post("/test")
-async def test(content: URL):
+async def test(content: URL, request: Request):
     # Process a video from a given URL
     url = content.url
     if not url:
         raise HTTPException(status_code=400, detail="Invalid URL")
     print(url)
     
-    audio_filename = video_processor.save_audio_yt_dlp(url)
-    if not audio_filename:
-        raise HTTPException(status_code=500, detail="Failed to process video.")
-
-    api_key = os.getenv('ASSEMBLYAI_API_KEY')
-    if not api_key:
-        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
-    aai.settings.api_key = api_key 
-
-    transcript = video_processor.transcribe(audio_filename)
+    transcript, source = await transcribe_video(
+        "test", content, request, [store.TEXT], video_processor.save_audio_yt_dlp
+    )
 
     response_data = {
-        'video_url': audio_filename,
-        'transcript': transcript  
+        'video_url': source,
+        'transcript': transcript.text
     }
 
-    # Clean up temporary files
-    video_processor.remove_temporary_files(audio_filename)
-
     return response_data
 
 @app.post("/upload")
-async def upload(content: URL):
+async def upload(content: URL, request: Request):
     # Process a video from a given URL
     url = content.url
     if not url:
@@ -280,7 +768,18 @@ async def upload(content: URL):
         raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
     aai.settings.api_key = api_key 
 
-    transcript = video_processor.entity_detection(url)
+    # The URL points at an audio file rather than a video page, so it keys the stored
+    # transcripts itself and there is no length to price by
+    features = [store.ENTITIES, store.SPEAKERS]
+    transcript = await video_processor.reuse_transcript(url, features)
+    if transcript is None:
+        async with video_processor.lease(url, features) as transcript:
+            if transcript is None:
+                async with (
+                    admission.admit("upload", client_id(request)),
+                    scheduler.slot(None, priority_of(request)),
+                ):
+                    transcript = await video_processor.entity_detection(url, video_id=url)
     transcript_text = transcript.text
     transcript_entity = transcript.entities
     transcript_utterance = transcript.utterances
@@ -292,17 +791,25 @@ async def upload(content: URL):
         'utterance': transcript_utterance
     }
 
-    return response_data
+    return TranscriptResponse(response_data)
 
 @app.post("/info")
-async def info(content: URL):
+async def info(content: URL, request: Request):
     # Process a video from a given URL
     url = content.url
     if not url:
         raise HTTPException(status_code=400, detail="Invalid URL")
     print(url)
     
-    video_id, video_length = video_processor.get_info(url)
+    if not parse_video_id(url):
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    async with admission.admit("info", client_id(request)):
+        try:
+            video_id, video_length = await run_in_threadpool(video_processor.get_info, url)
+        except Exception as e:
+            error_message = f"Failed to get video info. error: {e}"
+            raise HTTPException(status_code=500, detail=error_message)
   
     response_data = {
         'video_id': video_id,
@@ -312,68 +819,52 @@ async def info(content: URL):
     return response_data
 
 @app.post("/local")
-async def local(content: URL):
+async def local(content: URL, request: Request):
     # Process a video from a given URL
     url = content.url
     if not url:
         raise HTTPException(status_code=400, detail="Invalid URL")
     print(url)
     
-    audio_filename = video_processor.save_audio_yt_dlp_local(url)
-    if not audio_filename:
-        raise HTTPException(status_code=500, detail="Failed to process video.")
-
-    api_key = os.getenv('ASSEMBLYAI_API_KEY')
-    if not api_key:
-        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
-    aai.settings.api_key = api_key 
-
-    transcript = video_processor.transcribe(audio_filename)
+    # The downloaded file is kept in the working directory
+    transcript, source = await transcribe_video(
+        "local", content, request, [store.TEXT], video_processor.save_audio_yt_dlp_local,
+        keep_download=True,
+    )
 
     response_data = {
-        'video_url': audio_filename,
-        'transcript': transcript  
+        'video_url': source,
+        'transcript': transcript.text
     }
 
-    # Clean up temporary files
-    # video_processor.remove_temporary_files(audio_filename)
-
     return response_data
 
 @app.post("/detection")
-async def video_detection(content: URL):
+async def video_detection(content: URL, request: Request):
     # Process a video from a given URL
     url = content.url
     if not url:
         raise HTTPException(status_code=400, detail="Invalid URL")
     print(url)
 
-    try:
-        audio_filename = video_processor.save_audio(url)
-    except Exception as e:
-        error_message = f"Failed to process video. error: {e}"
-        raise HTTPException(status_code=500, detail=error_message)
-
-    if not audio_filename:
-        raise HTTPException(status_code=500, detail="Both methods failed, but no specific error was caught.")
+    transcript, source = await transcribe_video(
+        "detection", content, request, [store.ENTITIES, store.SPEAKERS], video_processor.save_audio
+    )
 
-    api_key = os.getenv('ASSEMBLYAI_API_KEY')
-    if not api_key:
-        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
-    aai.settings.api_key = api_key 
-
-    transcript = video_processor.entity_detection(audio_filename)
     transcript_text = transcript.text
-    entity_list_person = video_processor.entities_list(transcript.entities, "person_name")
-    entity_list_organization = video_processor.entities_list(transcript.entities, "organization")
-    entity_list_location = video_processor.entities_list(transcript.entities, "location")
-    utterance_list_text = video_processor.utterances_list(transcript.utterances, "text")
-    utterance_list_speaker = video_processor.utterances_list(transcript.utterances, "speaker")
-    utterance_list_start = video_processor.utterances_list(transcript.utterances, "start")
-    utterance_list_end = video_processor.utterances_list(transcript.utterances, "end")
+    # The list helpers work on plain dicts; utterances are made plain without their words
+    entities = plain(transcript.entities)
+    utterances = transcript.utterances.plain(words=False) if transcript.utterances is not None else None
+    entity_list_person = video_processor.entities_list(entities, "person_name")
+    entity_list_organization = video_processor.entities_list(entities, "organization")
+    entity_list_location = video_processor.entities_list(entities, "location")
+    utterance_list_text = video_processor.utterances_list(utterances, "text")
+    utterance_list_speaker = video_processor.utterances_list(utterances, "speaker")
+    utterance_list_start = video_processor.utterances_list(utterances, "start")
+    utterance_list_end = video_processor.utterances_list(utterances, "end")
   
     response_data = {
-        'video_url': audio_filename,
+        'video_url': source,
         'transcript': transcript_text,
         'entity_person': entity_list_person,
         'entity_organization': entity_list_organization,
@@ -384,13 +875,156 @@ async def video_detection(content: URL):
         'utterance_end': utterance_list_end
     }
 
-    # Clean up temporary files
-    video_processor.remove_temporary_files(audio_filename)
+    return response_data
+
+@app.post("/search")
+async def search(content: SearchQuery, request: Request):
+    # Search every indexed transcript for the given words
+    query = content.query.strip()
+    if not query:
+        raise HTTPException(status_code=400, detail="Invalid query")
+    limit = max(1, min(content.limit, 100))
+
+    async with admission.admit("search", client_id(request)):
+        try:
+            results = await run_in_threadpool(video_processor.index.search, query, limit)
+        except Exception as e:
+            error_message = f"Failed to search transcripts. error: {e}"
+            raise HTTPException(status_code=500, detail=error_message)
+
+    # Videos in the order of their best match
+    video_ids = list(dict.fromkeys(result['video_id'] for result in results))
+
+    response_data = {
+        'query': query,
+        'video_ids': video_ids,
+        'results': results
+    }
+
+    return response_data
+
+@app.post("/entities")
+async def entities(content: EntityQuery, request: Request):
+    # Which indexed videos mention an entity, and when and by whom
+    text = content.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Invalid entity")
+    limit = max(1, min(content.limit, 100))
+
+    async with admission.admit("search", client_id(request)):
+        try:
+            videos = await run_in_threadpool(
+                video_processor.index.entity_mentions, text, content.entity_type, limit
+            )
+        except Exception as e:
+            error_message = f"Failed to look up entity. error: {e}"
+            raise HTTPException(status_code=500, detail=error_message)
+
+    response_data = {
+        'entity': text,
+        'videos': videos
+    }
+
+    return response_data
+
+@app.post("/prefetch")
+async def prefetch_videos(content: PrefetchRequest, request: Request):
+    # Prepare videos before they are requested: metadata and player now, transcripts in the background
+    per_channel = max(1, min(content.per_channel, 50))
+
+    async with admission.admit("prefetch", client_id(request)):
+        try:
+            urls = await run_in_threadpool(prefetch.resolve, content.urls, content.channels, per_channel)
+            warmed = await run_in_threadpool(prefetch.warm, video_processor.metadata, urls)
+        except Exception as e:
+            error_message = f"Failed to prefetch videos. error: {e}"
+            raise HTTPException(status_code=500, detail=error_message)
+    queued = prefetcher.submit(urls) if content.transcribe else 0
+
+    response_data = {
+        'urls': urls,
+        'warmed': warmed,
+        'queued': queued,
+        'status': prefetcher.stats()
+    }
 
     return response_data
 
+@app.get("/prefetch")
+async def prefetch_status():
+    return prefetcher.stats()
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    # Report of a request made with X-Profile: 1, see profile_request
+    report = await run_in_threadpool(video_processor.shared.get, "profile", profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+@app.post("/webhooks/assemblyai")
+async def assemblyai_webhook(payload: TranscriptWebhook, request: Request):
+    # AssemblyAI calls this when a transcript submitted with ASSEMBLYAI_WEBHOOK_URL finishes.
+    # Without a secret no job is submitted with the webhook, so nothing may complete through it.
+    secret = os.getenv('ASSEMBLYAI_WEBHOOK_SECRET')
+    if not secret or not hmac.compare_digest(request.headers.get(WEBHOOK_AUTH_HEADER, ""), secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
+    api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    if not api_key:
+        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
+    aai.settings.api_key = api_key 
+
+    # Jobs waited on by another worker process are passed on to it through the shared cache
+    received = await video_processor.transcriber.notify(payload.transcript_id)
+
+    return {'transcript_id': payload.transcript_id, 'received': received}
+
+@app.websocket("/ws/realtime")
+async def realtime_transcription(websocket: WebSocket):
+    # Stream partial/final transcripts of a video or live stream while it downloads.
+    # The client sends {"url": ...} and receives {"type": "partial"|"final", "text", "start", "end"}
+    # messages, then {"type": "done"}. Websockets need the uvicorn deployment, not Lambda.
+    await websocket.accept()
+    content = await websocket.receive_json()
+    url = content.get('url') if isinstance(content, dict) else None
+    if not url:
+        await websocket.close(code=1008, reason="Invalid URL")
+        return
+    print(url)
+
+    api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    if not api_key:
+        raise ValueError("API Key not found. Please set the ASSEMBLYAI_API_KEY environment variable.")
+
+    transcriber = realtime.RealtimeTranscriber(api_key, url=os.getenv('ASSEMBLYAI_REALTIME_URL'))
+    try:
+        # A session holds its slot for as long as the stream runs, so sessions are not queued
+        async with admission.admit("realtime", client_id(websocket)):
+            media_url, is_live = await run_in_threadpool(realtime.resolve_audio_url, url)
+            frames = realtime.pcm_frames(media_url, live=is_live)
+            async for message in transcriber.stream(frames):
+                await websocket.send_json(message)
+    except RateLimited as e:
+        await websocket.close(code=1013, reason=f"Too many requests, retry after {e.retry_after}s")
+        return
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        await websocket.close(code=1011, reason=f"Failed to transcribe stream. error: {e}"[:120])
+        return
+
+    await websocket.send_json({'type': 'done'})
+    await websocket.close()
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WORKERS > 1 runs that many processes on the port, sharing the SQLite databases above.
+    # Admission limits and MAX_CONCURRENT_JOBS are divided between them (see worker_processes).
+    port = int(os.getenv('PORT', '8000'))
+    if worker_processes > 1:
+        uvicorn.run("app:app", host="0.0.0.0", port=port, workers=worker_processes)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
     
@@ -0,0 +1,286 @@
+"""
+This module contains the ffmpeg audio preprocessing done before transcription.
+
+Long silent intros, pauses and outros cost upload time and transcription
+minutes without adding any words. :func:`trim_silence` finds them with
+ffmpeg's energy based ``silencedetect`` filter, cuts them out and returns an
+:class:`OffsetMap` so every timestamp in the resulting transcript can be moved
+back to the original video time with :meth:`compact.CompactTranscript.remap`.
+
+:func:`cut_window` copies just a time window of a local or remote file, so
+a request for minutes 40-55 of a video downloads about fifteen minutes of
+audio rather than all of it.
+
+:class:`TranscodedStream` re-encodes audio to a compact speech format while it
+is being uploaded, which matters most for long videos on Lambda's bandwidth.
+
+"""
+import bisect
+import io
+import logging
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
+
+import ffmpeg
+
+logger = logging.getLogger(__name__)
+
+SILENCE_START_REGEX = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END_REGEX = re.compile(r"silence_end: (-?[\d.]+)")
+
+PIPE_CHUNK_SIZE = 64 * 1024
+
+
+class OffsetMap:
+    """Maps timestamps in cut audio back to the original audio.
+
+    :param list segments:
+        ``(original_start, original_end)`` pairs in seconds, in order, for
+        every span kept in the cut audio.
+    """
+
+    def __init__(self, segments: List[Tuple[float, float]]):
+        self.segments = segments
+        self._cut_starts = []  # ms in the cut audio where each segment begins
+        self._original_starts = []  # ms in the original audio where each segment begins
+        position = 0
+        for start, end in segments:
+            self._cut_starts.append(position)
+            self._original_starts.append(round(start * 1000))
+            position += round((end - start) * 1000)
+        self.cut_duration = position
+
+    def to_original(self, ms: Optional[int], end: bool = False) -> Optional[int]:
+        """Translate a cut-audio timestamp in milliseconds to original time.
+
+        A timestamp that falls exactly on the boundary between two segments is
+        ambiguous; ``end=True`` resolves it to the end of the earlier segment,
+        which is what a word or utterance ``end`` means.
+        """
+        if ms is None or not self._cut_starts:
+            return ms
+        if end:
+            index = bisect.bisect_left(self._cut_starts, ms) - 1
+        else:
+            index = bisect.bisect_right(self._cut_starts, ms) - 1
+        index = max(index, 0)
+        return self._original_starts[index] + ms - self._cut_starts[index]
+
+    def shift(self, seconds: float) -> "OffsetMap":
+        """The same map for audio that itself starts ``seconds`` into the original."""
+        return OffsetMap([(start + seconds, end + seconds) for start, end in self.segments])
+
+
+def probe_duration(path: str) -> float:
+    """Duration of the media file at ``path`` in seconds."""
+    return float(ffmpeg.probe(path)["format"]["duration"])
+
+
+def detect_silence(path: str, noise_db: float = -35.0,
+                   min_silence: float = 2.0) -> List[Tuple[float, float]]:
+    """Find silent regions with ffmpeg's ``silencedetect`` filter.
+
+    :param str path:
+        Audio file to scan.
+    :param float noise_db:
+        Level below which audio counts as silence.
+    :param float min_silence:
+        Shortest silence reported, in seconds.
+    :rtype: list
+    :returns:
+        ``(start, end)`` pairs in seconds. A silence running to the end of
+        the file is returned with ``end`` set to ``None``.
+    """
+    _, stderr = (
+        ffmpeg
+        .input(path)
+        .filter("silencedetect", noise=f"{noise_db}dB", d=min_silence)
+        .output("-", format="null")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    silences = []
+    start = None
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        start_match = SILENCE_START_REGEX.search(line)
+        if start_match:
+            start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = SILENCE_END_REGEX.search(line)
+        if end_match and start is not None:
+            silences.append((start, float(end_match.group(1))))
+            start = None
+    if start is not None:
+        silences.append((start, None))
+    return silences
+
+
+def speech_segments(silences: List[Tuple[float, Optional[float]]], duration: float,
+                    padding: float = 0.5) -> List[Tuple[float, float]]:
+    """Invert silent regions into the spans worth keeping.
+
+    Each silence is shrunk by ``padding`` on the sides that touch speech so
+    words are not clipped at the cut points.
+    """
+    segments = []
+    position = 0.0
+    for start, end in silences:
+        end = duration if end is None else end
+        cut_start = start + padding if start > 0 else start
+        cut_end = end - padding if end < duration else end
+        if cut_end <= cut_start:
+            continue
+        if cut_start > position:
+            segments.append((position, cut_start))
+        position = cut_end
+    if position < duration:
+        segments.append((position, duration))
+    return segments
+
+
+def trim_silence(path: str, noise_db: float = -35.0, min_silence: float = 2.0,
+                 padding: float = 0.5, min_saving: float = 0.05) -> Tuple[str, Optional[OffsetMap]]:
+    """Cut the silent regions out of ``path``.
+
+    :param float min_saving:
+        Fraction of the duration that must be removable for the cut to be worth
+        an extra ffmpeg pass.
+    :rtype: tuple
+    :returns:
+        The path to transcribe and the map back to original time. If nothing
+        worth cutting was found, the input path and ``None`` are returned.
+    """
+    duration = probe_duration(path)
+    segments = speech_segments(detect_silence(path, noise_db, min_silence), duration, padding)
+    kept = sum(end - start for start, end in segments)
+    if not segments or duration - kept < duration * min_saving:
+        return path, None
+
+    selection = "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in segments)
+    base, ext = os.path.splitext(path)
+    out_path = f"{base}.speech{ext}"
+    (
+        ffmpeg
+        .input(path)
+        .audio
+        .filter("aselect", selection)
+        .filter("asetpts", "N/SR/TB")
+        .output(out_path, acodec="aac")
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    logger.info("trimmed %.1fs of silence from %s", duration - kept, path)
+    return out_path, OffsetMap(segments)
+
+
+def cut_window(source: str, start: float, end: Optional[float], out_path: str) -> str:
+    """Copy ``start`` to ``end`` seconds of ``source`` to ``out_path`` without re-encoding.
+
+    :param str source:
+        A file path or an HTTP(S) media URL. The seek is an input option, so
+        on a URL ffmpeg jumps to ``start`` with ranged requests instead of
+        reading everything before it, and stops reading at ``end``.
+    :param float end:
+        End of the window, or ``None`` for the end of the file.
+    :rtype: str
+    :returns:
+        ``out_path``.
+    """
+    output_options = {"acodec": "copy"}
+    if end is not None:
+        output_options["t"] = f"{end - start:.3f}"
+    (
+        ffmpeg
+        .input(source, ss=f"{start:.3f}")
+        .audio
+        .output(out_path, **output_options)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    logger.info("copied %.1fs-%s of %s", start, f"{end:.1f}s" if end is not None else "end", source)
+    return out_path
+
+
+# Speech recognition gains nothing from stereo or more than 16 kHz, and Opus
+# stays intelligible for speech well below 32 kbps.
+UPLOAD_FORMATS = {
+    "opus": {"format": "ogg", "acodec": "libopus", "audio_bitrate": "24k"},
+    "flac": {"format": "flac", "acodec": "flac"},
+}
+
+
+class TranscodedStream(io.RawIOBase):
+    """Read-only stream of ``source`` re-encoded as mono 16 kHz speech audio.
+
+    ffmpeg writes to a pipe that is read directly by the uploader, so no
+    transcoded copy is ever written to disk or held in memory as a whole.
+
+    :param source:
+        A file path, which ffmpeg opens itself, or a bytes-like object or
+        readable binary file, which is fed through ffmpeg's stdin. Paths are
+        not piped because MP4 files with a trailing ``moov`` atom (as written
+        by yt-dlp's audio extraction) can only be demuxed from a seekable input.
+    :param str codec:
+        ``opus`` (lossy, smallest) or ``flac`` (lossless).
+    :param int sample_rate:
+        Output sample rate in Hz.
+    """
+
+    def __init__(self, source, codec: str = "opus", sample_rate: int = 16000):
+        super().__init__()
+        self.bytes_read = 0
+        self._source = source
+        self._feeder = None
+        piped = not isinstance(source, (str, os.PathLike))
+        stream = ffmpeg.input("pipe:0" if piped else os.fspath(source))
+        self._process = (
+            stream.audio
+            .output("pipe:1", ac=1, ar=sample_rate, **UPLOAD_FORMATS[codec])
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=piped, pipe_stdout=True)
+        )
+        if piped:
+            # Feed stdin from a thread so ffmpeg never blocks on a full stdout pipe
+            self._feeder = threading.Thread(target=self._feed, daemon=True)
+            self._feeder.start()
+
+    def _feed(self):
+        try:
+            if hasattr(self._source, "read"):
+                while True:
+                    chunk = self._source.read(PIPE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self._process.stdin.write(chunk)
+            else:
+                view = memoryview(self._source)
+                for offset in range(0, len(view), PIPE_CHUNK_SIZE):
+                    self._process.stdin.write(view[offset:offset + PIPE_CHUNK_SIZE])
+        except (BrokenPipeError, ValueError):
+            # ffmpeg exited early; its exit code is reported by close()
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._process.stdout.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def close(self):
+        if self.closed:
+            return
+        self._process.stdout.close()
+        returncode = self._process.wait()
+        if self._feeder is not None:
+            self._feeder.join()
+        super().close()
+        if returncode not in (0, None):
+            raise RuntimeError(f"ffmpeg exited with code {returncode} while transcoding")
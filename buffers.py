@@ -0,0 +1,150 @@
+"""
+This module contains the in-memory audio buffers used between download and upload.
+
+For small and medium videos, saving to ``/tmp``, renaming, re-opening and
+reading the file back for the upload is pure overhead. An
+:class:`AudioBuffer` is sized up front from the stream's content length and
+filled once by the downloader. The uploader then reads it through a
+``memoryview``, so the audio is never copied as a whole. Buffers above a
+size threshold are backed by a memory-mapped temporary file instead of heap
+memory, so the kernel can page them out under pressure.
+
+Every buffer reserves its size from a shared :class:`BufferBudget` first.
+When the budget is exhausted the caller falls back to the file path, which
+keeps the audio buffered by concurrent requests under a fixed limit.
+
+"""
+import io
+import mmap
+import tempfile
+import threading
+
+
+class BufferBudget:
+    """Upper bound on the bytes held by all live buffers together."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_reserve(self, size: int) -> bool:
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self.used -= size
+
+
+class BufferReader(io.RawIOBase):
+    """Readable file object over a ``memoryview``; reads copy only the requested chunk."""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self._view) - self._position)
+        buffer[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, min(offset, len(self._view)))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class AudioBuffer:
+    """Fixed-size buffer filled by a downloader and read by an uploader.
+
+    Use :meth:`allocate` rather than the constructor so the size is charged to
+    a budget. The buffer implements ``write`` so it can be passed to
+    pytube's ``Stream.stream_to_buffer``.
+
+    :param int size:
+        Expected number of bytes.
+    :param BufferBudget budget:
+        Budget the size was reserved from; released by :meth:`close`.
+    :param bool mapped:
+        Back the buffer with a memory-mapped temporary file instead of a bytearray.
+    """
+
+    def __init__(self, size: int, budget: BufferBudget, mapped: bool = False):
+        self.size = size
+        self.length = 0
+        self._budget = budget
+        self._file = None
+        if mapped:
+            self._file = tempfile.TemporaryFile(dir="/tmp")
+            self._file.truncate(size)
+            self._storage = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._storage = bytearray(size)
+        self._view = memoryview(self._storage)
+
+    @classmethod
+    def allocate(cls, size: int, budget: BufferBudget, mmap_threshold: int):
+        """Reserve ``size`` bytes from ``budget``; ``None`` if that would exceed it."""
+        if size <= 0 or not budget.try_reserve(size):
+            return None
+        try:
+            return cls(size, budget, mapped=size >= mmap_threshold)
+        except Exception:
+            budget.release(size)
+            raise
+
+    def write(self, chunk) -> int:
+        end = self.length + len(chunk)
+        if end > self.size:
+            raise BufferError(f"Download exceeded its announced size of {self.size} bytes")
+        self._view[self.length:end] = chunk
+        self.length = end
+        return len(chunk)
+
+    @property
+    def view(self) -> memoryview:
+        """The bytes written so far, without copying."""
+        return self._view[:self.length]
+
+    def reader(self) -> BufferReader:
+        return BufferReader(self.view)
+
+    def close(self):
+        if self._budget is None:
+            return
+        try:
+            self._view.release()
+            if self._file is not None:
+                self._storage.close()
+        except BufferError:
+            # A reader still holds a view; the storage is freed when that is collected
+            pass
+        if self._file is not None:
+            self._file.close()
+        self._storage = None
+        self._budget.release(self.size)
+        self._budget = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
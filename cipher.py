@@ -12,6 +12,7 @@ functions" (2) maps them to Python equivalents and (3) taking the ciphered
 signature and decoding it.
 
 """
+import functools
 import logging
 import re
 from itertools import chain
@@ -23,6 +24,11 @@ from pytube.parser import find_object_from_startpoint, throttling_array_split
 
 logger = logging.getLogger(__name__)
 
+# A Cipher is built for every YouTube object, but base.js only changes with the
+# player version. The regex scans over it are memoized per base.js for this many
+# versions; their results are never mutated, unlike the throttling array.
+PARSE_CACHE_SIZE = 4
+
 
 class Cipher:
     def __init__(self, js: str):
@@ -171,6 +177,7 @@ def get_initial_function_name(js: str) -> str:
     )
 
 
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
 def get_transform_plan(js: str) -> List[str]:
     """Extract the "transform plan".
 
@@ -197,6 +204,7 @@ def get_transform_plan(js: str) -> List[str]:
     return regex_search(pattern, js, group=1).split(";")
 
 
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
 def get_transform_object(js: str, var: str) -> List[str]:
     """Extract the "transform object".
 
@@ -298,6 +306,7 @@ def get_throttling_function_name(js: str) -> str:
     )
 
 
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
 def get_throttling_function_code(js: str) -> str:
     """Extract the raw code for the throttling function.
 
@@ -0,0 +1,359 @@
+"""
+This module contains the compact in-memory form of transcripts.
+
+The SDK parses every word of a transcript into a pydantic model of several
+hundred bytes, and with speaker labels every word is there twice: once in
+``words`` and once in its utterance. A multi-hour video is then hundreds of
+MB of Python objects, held for as long as the request runs. A
+:class:`CompactTranscript` instead keeps (1) word and utterance timestamps,
+confidences and speakers in typed arrays, with speakers as indexes into a
+table of labels, (2) texts as interned strings, so each distinct word is
+stored once however often it is said, and (3) the words of each utterance as
+a range over a block of word columns.
+
+Code reading a transcript sees the usual attributes: ``words`` and
+``utterances`` are read-only sequences that build a small record for an item
+only when it is accessed, and responses are built straight from the columns
+by :func:`serialization.plain`, which calls their ``plain()`` method.
+Timestamps are changed with :meth:`CompactTranscript.remap`.
+
+"""
+import logging
+import math
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple
+
+from audio import OffsetMap
+from serialization import model_fields
+
+logger = logging.getLogger(__name__)
+
+# Attributes of words and utterances stored in columns; any other field of the
+# SDK models (e.g. ``channel``) is kept only for the items that set it
+COLUMNS = ("text", "start", "end", "confidence", "speaker")
+# Milliseconds fit in a C int for about 24 days of audio; this marks a missing timestamp
+NO_TIME = -2 ** 31
+
+
+def _time(value: Optional[int]) -> int:
+    return NO_TIME if value is None else value
+
+
+def _from_time(value: int) -> Optional[int]:
+    return None if value == NO_TIME else value
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if type(value) is str else value
+
+
+def _field_names(item: Any, default: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Field names of an SDK model (or namespace), which become the keys of its response dict."""
+    if item is None:
+        return default
+    names = tuple(name for name, _ in model_fields(type(item)))
+    if not names and hasattr(item, "__dict__"):
+        names = tuple(name for name in vars(item) if not name.startswith("_"))
+    return names or default
+
+
+class Labels:
+    """Table of distinct labels (speakers), referenced by index; ``-1`` stands for ``None``."""
+
+    __slots__ = ("values", "_codes")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def value(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.values[code]
+
+
+class Columns:
+    """Timed items (words or utterances) stored column-wise.
+
+    :param Labels speakers:
+        Speaker table shared by every column block of a transcript.
+    :param tuple names:
+        Field names of the items, in the order their response keys are written.
+    """
+
+    __slots__ = ("names", "speakers", "text", "start", "end", "confidence", "speaker", "extras")
+
+    def __init__(self, speakers: Labels, names: Tuple[str, ...] = COLUMNS):
+        self.names = names
+        self.speakers = speakers
+        self.text: List[Optional[str]] = []
+        self.start = array("i")
+        self.end = array("i")
+        self.confidence = array("d")  # doubles, so responses show the confidence the API sent
+        self.speaker = array("h")
+        self.extras: Dict[str, Dict[int, Any]] = {}  # field -> {index: value} for values that are set
+
+    def __len__(self):
+        return len(self.text)
+
+    def append(self, item: Any):
+        index = len(self.text)
+        self.text.append(_text(item.text))
+        self.start.append(_time(item.start))
+        self.end.append(_time(item.end))
+        confidence = getattr(item, "confidence", None)
+        self.confidence.append(math.nan if confidence is None else confidence)
+        self.speaker.append(self.speakers.code(getattr(item, "speaker", None)))
+        for name in self.names:
+            if name not in COLUMNS and name != "words":
+                value = getattr(item, name, None)
+                if value is not None:
+                    self.extras.setdefault(name, {})[index] = value
+
+    def remap(self, offsets: OffsetMap):
+        for index, value in enumerate(self.start):
+            if value != NO_TIME:
+                self.start[index] = offsets.to_original(value)
+        for index, value in enumerate(self.end):
+            if value != NO_TIME:
+                self.end[index] = offsets.to_original(value, end=True)
+
+    def values(self, index: int) -> Tuple:
+        """``(text, start, end, confidence, speaker)`` of an item."""
+        confidence = self.confidence[index]
+        return (
+            self.text[index],
+            _from_time(self.start[index]),
+            _from_time(self.end[index]),
+            None if math.isnan(confidence) else confidence,
+            self.speakers.value(self.speaker[index]),
+        )
+
+    def plain(self, index: int, **fields) -> dict:
+        """The item as a response dict; ``fields`` supplies values not held in the columns."""
+        item = dict(zip(COLUMNS, self.values(index)))
+        for name in self.names:
+            if name not in item:
+                item[name] = fields[name] if name in fields else self.extras.get(name, {}).get(index)
+        return item
+
+
+class Word:
+    """A word, built from its columns when accessed; changing it does not change the transcript."""
+
+    __slots__ = ("text", "start", "end", "confidence", "speaker")
+
+    def __init__(self, text, start, end, confidence, speaker):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+        self.speaker = speaker
+
+
+class Utterance:
+    """An utterance, built from its columns when accessed; ``words`` is a view of its words."""
+
+    __slots__ = ("text", "start", "end", "confidence", "speaker", "words")
+
+    def __init__(self, text, start, end, confidence, speaker, words):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+        self.speaker = speaker
+        self.words = words
+
+
+class Entity:
+    """A detected entity; ``entity_type`` is the type's string value."""
+
+    __slots__ = ("entity_type", "text", "start", "end")
+
+    def __init__(self, entity_type, text, start, end):
+        self.entity_type = entity_type
+        self.text = text
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_sdk(cls, entity: Any) -> "Entity":
+        entity_type = getattr(entity.entity_type, "value", entity.entity_type)
+        return cls(_text(entity_type), _text(entity.text), entity.start, entity.end)
+
+    def plain(self) -> dict:
+        return {"entity_type": self.entity_type, "text": self.text, "start": self.start, "end": self.end}
+
+
+class WordList(Sequence):
+    """Read-only view of words ``first`` to ``stop`` of a column block."""
+
+    __slots__ = ("_columns", "_first", "_stop")
+
+    def __init__(self, columns: Columns, first: int = 0, stop: Optional[int] = None):
+        self._columns = columns
+        self._first = first
+        self._stop = len(columns) if stop is None else stop
+
+    def __len__(self):
+        return self._stop - self._first
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(first, stop, step)]
+            return WordList(self._columns, self._first + first, self._first + max(first, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("word index out of range")
+        return Word(*self._columns.values(self._first + index))
+
+    def __iter__(self):
+        values = self._columns.values
+        for index in range(self._first, self._stop):
+            yield Word(*values(index))
+
+    def plain(self) -> List[dict]:
+        return [self._columns.plain(index) for index in range(self._first, self._stop)]
+
+
+class UtteranceList(Sequence):
+    """Read-only view of a transcript's utterances.
+
+    :param Columns columns:
+        The utterances' own fields.
+    :param Columns words:
+        The words of all utterances, in order.
+    :param array word_stops:
+        Index in ``words`` after the last word of each utterance.
+    """
+
+    __slots__ = ("_columns", "_words", "_word_stops")
+
+    def __init__(self, columns: Columns, words: Columns, word_stops: array):
+        self._columns = columns
+        self._words = words
+        self._word_stops = word_stops
+
+    def __len__(self):
+        return len(self._columns)
+
+    def _word_range(self, index: int) -> Tuple[int, int]:
+        return (self._word_stops[index - 1] if index else 0), self._word_stops[index]
+
+    def _utterance(self, index: int) -> Utterance:
+        return Utterance(*self._columns.values(index), WordList(self._words, *self._word_range(index)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._utterance(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("utterance index out of range")
+        return self._utterance(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._utterance(index)
+
+    def plain(self, words: bool = True) -> List[dict]:
+        """The utterances as response dicts; ``words=False`` leaves out their words."""
+        if not words:
+            return [{"speaker": speaker, "text": text, "start": start, "end": end}
+                    for text, start, end, _, speaker in map(self._columns.values, range(len(self)))]
+        return [
+            self._columns.plain(index, words=WordList(self._words, *self._word_range(index)).plain())
+            for index in range(len(self))
+        ]
+
+
+class CompactTranscript:
+    """A completed transcript with its words and utterances held in columns.
+
+    Built with :meth:`from_transcript`; the SDK transcript can be dropped
+    afterwards. Chapters are few and are kept as the SDK returned them.
+    """
+
+    __slots__ = ("id", "status", "error", "text", "summary", "chapters", "entities",
+                 "_speakers", "_words", "_utterances", "_utterance_words", "_word_stops")
+
+    def __init__(self, id: Optional[str], status: Any, text: Optional[str] = None):
+        self.id = id
+        self.status = status
+        self.error = None
+        self.text = text
+        self.summary = None
+        self.chapters = None
+        self.entities: Optional[List[Entity]] = None
+        self._speakers = Labels()
+        self._words: Optional[Columns] = None
+        self._utterances: Optional[Columns] = None
+        self._utterance_words: Optional[Columns] = None
+        self._word_stops = array("i")
+
+    @classmethod
+    def from_transcript(cls, transcript: Any) -> Optional["CompactTranscript"]:
+        """Copy an SDK transcript (or any object shaped like one) into columns."""
+        if transcript is None or isinstance(transcript, cls):
+            return transcript
+        compact = cls(getattr(transcript, "id", None), getattr(transcript, "status", None),
+                      getattr(transcript, "text", None))
+        compact.error = getattr(transcript, "error", None)
+        compact.summary = getattr(transcript, "summary", None)
+        compact.chapters = getattr(transcript, "chapters", None)
+        entities = getattr(transcript, "entities", None)
+        if entities is not None:
+            compact.entities = [Entity.from_sdk(entity) for entity in entities]
+        words = getattr(transcript, "words", None)
+        if words is not None:
+            compact._words = compact._columns(words)
+        utterances = getattr(transcript, "utterances", None)
+        if utterances is not None:
+            compact._utterances = compact._columns(utterances)
+            first = next((word for utterance in utterances for word in utterance.words or ()), None)
+            compact._utterance_words = Columns(compact._speakers, _field_names(first, COLUMNS))
+            for utterance in utterances:
+                for word in utterance.words or ():
+                    compact._utterance_words.append(word)
+                compact._word_stops.append(len(compact._utterance_words))
+        return compact
+
+    def _columns(self, items) -> Columns:
+        columns = Columns(self._speakers, _field_names(items[0] if items else None, COLUMNS))
+        for item in items:
+            columns.append(item)
+        return columns
+
+    @property
+    def words(self) -> Optional[WordList]:
+        return WordList(self._words) if self._words is not None else None
+
+    @property
+    def utterances(self) -> Optional[UtteranceList]:
+        if self._utterances is None:
+            return None
+        return UtteranceList(self._utterances, self._utterance_words, self._word_stops)
+
+    def remap(self, offsets: Optional[OffsetMap]) -> "CompactTranscript":
+        """Move every timestamp from cut-audio time to original time, in place."""
+        if offsets is None:
+            return self
+        for columns in (self._words, self._utterances, self._utterance_words):
+            if columns is not None:
+                columns.remap(offsets)
+        for item in (self.entities or []) + list(self.chapters or []):
+            item.start = offsets.to_original(item.start)
+            item.end = offsets.to_original(item.end, end=True)
+        return self
@@ -0,0 +1,244 @@
+"""
+This module contains the admission control for the expensive API routes.
+
+Every download + transcription holds memory, ``/tmp`` space and one slot of
+the AssemblyAI concurrency quota for minutes at a time, so a burst of requests
+has to be shaped before it reaches ``VideoProcessor``. Admission is decided in
+two steps:
+
+(1) token buckets, one per route and one per (route, client), refilled at a
+    steady rate. A request spends tokens proportional to its estimated cost,
+    which for video routes grows with the video length.
+(2) a concurrency limit per route with a bounded FIFO queue behind it.
+
+A request that fails either step raises :class:`RateLimited`, carrying the
+number of seconds after which a retry is likely to be admitted.
+
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+
+class RateLimited(Exception):
+    """Raised when a request is shed; ``retry_after`` is in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Classic token bucket.
+
+    :param float rate:
+        Tokens added per second.
+    :param float capacity:
+        Maximum number of tokens, i.e. the largest burst allowed.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self, cost: float) -> float:
+        """Take ``cost`` tokens if available.
+
+        Costs larger than the bucket are capped at its capacity, so a single
+        very long video drains the bucket instead of being refused forever.
+
+        :rtype: float
+        :returns:
+            0 if the tokens were taken, otherwise the seconds until they will be.
+        """
+        cost = min(cost, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            return (cost - self.tokens) / self.rate
+
+    def refund(self, cost: float):
+        """Return tokens taken for a request that was shed further down."""
+        cost = min(cost, self.capacity)
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class ConcurrencyLimit:
+    """At most ``max_concurrent`` holders, with up to ``max_queue`` waiting in FIFO order."""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = deque()
+        # Moving average of how long a slot is held, used to estimate Retry-After
+        self.avg_hold = 30.0
+
+    async def acquire(self):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            # Everyone queued plus one turn of the running jobs must finish first
+            turns = len(self._waiters) / self.max_concurrent + 1
+            raise RateLimited("queue full", self.avg_hold * turns)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed to us just as we were cancelled; pass it on
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, held_for: Optional[float] = None):
+        if held_for is not None:
+            self.avg_hold = 0.8 * self.avg_hold + 0.2 * held_for
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Hand the slot straight to the next waiter; ``active`` is unchanged
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class RouteLimits:
+    """Limits for one route.
+
+    :param float rate:
+        Route-wide tokens per second.
+    :param float burst:
+        Route-wide bucket capacity.
+    :param float client_rate:
+        Tokens per second for a single client on this route.
+    :param float client_burst:
+        Bucket capacity for a single client on this route.
+    :param int max_concurrent:
+        Requests allowed to run at once.
+    :param int max_queue:
+        Requests allowed to wait for a running slot before shedding.
+    """
+
+    def __init__(self, rate: float, burst: float, client_rate: float, client_burst: float,
+                 max_concurrent: int, max_queue: int):
+        self.rate = rate
+        self.burst = burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+
+    def divided(self, processes: int) -> "RouteLimits":
+        """This process's share of the limits when ``processes`` processes serve the route.
+
+        Rates and bursts are split evenly; concurrency and queue lengths are
+        rounded up, so every process can still run at least one request.
+        """
+        if processes <= 1:
+            return self
+        return RouteLimits(
+            rate=self.rate / processes,
+            burst=self.burst / processes,
+            client_rate=self.client_rate / processes,
+            client_burst=self.client_burst / processes,
+            max_concurrent=max(1, math.ceil(self.max_concurrent / processes)),
+            max_queue=math.ceil(self.max_queue / processes),
+        )
+
+
+class AdmissionController:
+    """Per-route and per-client admission for the API.
+
+    :param dict limits:
+        Mapping of route name to :class:`RouteLimits`.
+    :param int seconds_per_token:
+        Video seconds that cost one extra token, see :meth:`cost`.
+    :param int max_clients:
+        Client buckets kept per route; the least recently used are dropped.
+    """
+
+    def __init__(self, limits: Dict[str, RouteLimits], seconds_per_token: int = 600,
+                 max_clients: int = 10000):
+        self.limits = limits
+        self.seconds_per_token = seconds_per_token
+        self.max_clients = max_clients
+        self._route_buckets = {
+            name: TokenBucket(limit.rate, limit.burst) for name, limit in limits.items()
+        }
+        self._client_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._concurrency = {
+            name: ConcurrencyLimit(limit.max_concurrent, limit.max_queue)
+            for name, limit in limits.items()
+        }
+
+    def cost(self, video_length: Optional[int]) -> float:
+        """Tokens charged for a video of ``video_length`` seconds.
+
+        Every request costs one token; each started ``seconds_per_token`` of
+        video adds one more, so a two hour video costs 13 tokens by default.
+        Unknown lengths are charged the base cost.
+        """
+        if not video_length:
+            return 1.0
+        return 1.0 + math.ceil(video_length / self.seconds_per_token)
+
+    def _client_bucket(self, route: str, client: str) -> TokenBucket:
+        key = (route, client)
+        bucket = self._client_buckets.pop(key, None)
+        if bucket is None:
+            limit = self.limits[route]
+            bucket = TokenBucket(limit.client_rate, limit.client_burst)
+            if len(self._client_buckets) >= self.max_clients:
+                # dicts keep insertion order, and every hit re-inserts its key
+                del self._client_buckets[next(iter(self._client_buckets))]
+        self._client_buckets[key] = bucket
+        return bucket
+
+    @asynccontextmanager
+    async def admit(self, route: str, client: str, cost: float = 1.0):
+        """Hold an admission slot for ``route`` for the duration of the block.
+
+        :raises RateLimited:
+            If the client or route is out of tokens, or the route's queue is full.
+        """
+        client_bucket = self._client_bucket(route, client)
+        wait = client_bucket.try_take(cost)
+        if wait:
+            raise RateLimited("client rate limit exceeded", wait)
+        route_bucket = self._route_buckets[route]
+        wait = route_bucket.try_take(cost)
+        if wait:
+            client_bucket.refund(cost)
+            raise RateLimited("route rate limit exceeded", wait)
+
+        concurrency = self._concurrency[route]
+        try:
+            await concurrency.acquire()
+        except RateLimited:
+            client_bucket.refund(cost)
+            route_bucket.refund(cost)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            concurrency.release(time.monotonic() - started)
@@ -0,0 +1,310 @@
+"""
+This module contains the video metadata lookups used by the API.
+
+Most routes only need a handful of facts about a video (its ID, length, title
+and the player version that signs its streams) before deciding what to do with
+it. Building a full ``YouTube`` object for each of those questions costs at
+least one network round trip, so this module (1) parses the video ID straight
+from the URL, (2) caches the remaining metadata per video ID with a TTL and
+(3) keeps the ``YouTube`` object that answered a lookup around for a short
+while so a download in the same request reuses its already-fetched pages.
+
+When several worker processes run, a :class:`shared.SharedCache` can back the
+metadata entries and the player's base.js (keyed by its URL, which names the
+player version), so each video and each player version is fetched once per
+host rather than once per process.
+
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from pytube import YouTube
+
+from shared import SharedCache
+
+logger = logging.getLogger(__name__)
+
+VIDEO_ID_REGEX = re.compile(r"^[0-9A-Za-z_-]{11}$")
+PLAYER_VERSION_REGEX = re.compile(r"/s/player/([\w-]+)/")
+
+# Path prefixes that are followed directly by the video ID,
+# e.g. https://www.youtube.com/shorts/<id>
+ID_PATH_PREFIXES = ("embed", "shorts", "live", "v", "e")
+
+
+def on_domain(host: str, domain: str) -> bool:
+    """Whether ``host`` is ``domain`` or one of its subdomains."""
+    return host == domain or host.endswith("." + domain)
+
+
+def parse_video_id(url: str) -> Optional[str]:
+    """Extract the video ID from a YouTube URL without any network call.
+
+    :param str url:
+        A watch, short, embed, live or youtu.be URL, or a bare video ID.
+    :rtype: str
+    :returns:
+        The 11 character video ID, or ``None`` if ``url`` does not contain one.
+
+    **Example**:
+
+    >>> parse_video_id('https://youtu.be/dQw4w9WgXcQ?t=42')
+    'dQw4w9WgXcQ'
+    """
+    if not url:
+        return None
+    url = url.strip()
+    if VIDEO_ID_REGEX.match(url):
+        return url
+
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    segments = [s for s in parsed.path.split("/") if s]
+
+    candidate = None
+    if on_domain(host, "youtu.be"):
+        candidate = segments[0] if segments else None
+    elif on_domain(host, "youtube.com") or on_domain(host, "youtube-nocookie.com"):
+        query = parse_qs(parsed.query)
+        if "v" in query:
+            candidate = query["v"][0]
+        elif len(segments) >= 2 and segments[0] in ID_PATH_PREFIXES:
+            candidate = segments[1]
+
+    if candidate and VIDEO_ID_REGEX.match(candidate):
+        return candidate
+    return None
+
+
+def watch_url(video_id: str) -> str:
+    """Canonical watch URL for ``video_id``."""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def player_version(js_url: Optional[str]) -> Optional[str]:
+    """Extract the player version from a base.js URL.
+
+    **Example**:
+
+    >>> player_version('/s/player/4fcd6e4a/player_ias.vflset/en_US/base.js')
+    '4fcd6e4a'
+    """
+    if not js_url:
+        return None
+    match = PLAYER_VERSION_REGEX.search(js_url)
+    return match.group(1) if match else None
+
+
+class VideoMetadata:
+    """Cached facts about a single video."""
+
+    def __init__(self, video_id: str, length: Optional[int] = None,
+                 title: Optional[str] = None, player_version: Optional[str] = None):
+        self.video_id = video_id
+        self.length = length
+        self.title = title
+        self.player_version = player_version
+
+    def __repr__(self):
+        return (f"VideoMetadata(video_id={self.video_id!r}, length={self.length!r}, "
+                f"title={self.title!r}, player_version={self.player_version!r})")
+
+
+class MetadataCache:
+    """Per-video-ID metadata cache.
+
+    :param int ttl:
+        Seconds a metadata entry stays valid.
+    :param int page_ttl:
+        Seconds the ``YouTube`` object behind a lookup is kept for reuse by a
+        following download. It holds the watch page and player response, so
+        this is deliberately much shorter than ``ttl``.
+    :param int max_pages:
+        Most ``YouTube`` objects kept at once; the least recently kept are
+        dropped first.
+    :param int max_workers:
+        Upper bound on concurrent fetches in :meth:`lookup_many`.
+    :param SharedCache shared:
+        Optional cache shared with other processes, consulted on local misses.
+    :param int player_ttl:
+        Seconds a base.js is kept in ``shared``.
+    """
+
+    def __init__(self, ttl: int = 3600, page_ttl: int = 300, max_pages: int = 32, max_workers: int = 4,
+                 shared: Optional[SharedCache] = None, player_ttl: int = 24 * 3600):
+        self.ttl = ttl
+        self.page_ttl = page_ttl
+        self.max_pages = max_pages
+        self.max_workers = max_workers
+        self.shared = shared
+        self.player_ttl = player_ttl
+        self._entries: Dict[str, tuple] = {}  # video_id -> (expires_at, VideoMetadata)
+        self._pages: "OrderedDict[str, tuple]" = OrderedDict()  # video_id -> (expires_at, YouTube)
+        self._lock = threading.Lock()
+
+    def get(self, video_id: str) -> Optional[VideoMetadata]:
+        """Return the cached entry for ``video_id`` if it has not expired."""
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                expires_at, metadata = entry
+                if expires_at >= time.monotonic():
+                    return metadata
+                del self._entries[video_id]
+        if self.shared is None:
+            return None
+        try:
+            fields = self.shared.get("metadata", video_id)
+        except Exception as e:
+            logger.warning("shared metadata lookup failed for %s: %s", video_id, e)
+            return None
+        if fields is None:
+            return None
+        metadata = VideoMetadata(**fields)
+        with self._lock:
+            self._entries[video_id] = (time.monotonic() + self.ttl, metadata)
+        return metadata
+
+    def put(self, metadata: VideoMetadata):
+        with self._lock:
+            self._entries[metadata.video_id] = (time.monotonic() + self.ttl, metadata)
+        if self.shared is not None:
+            try:
+                self.shared.put("metadata", metadata.video_id, vars(metadata), self.ttl)
+            except Exception as e:
+                logger.warning("shared metadata write failed for %s: %s", metadata.video_id, e)
+
+    def lookup(self, url: str) -> VideoMetadata:
+        """Return metadata for the video at ``url``, fetching it on a cache miss.
+
+        :raises ValueError:
+            If no video ID can be parsed from ``url``.
+        """
+        video_id = parse_video_id(url)
+        if not video_id:
+            raise ValueError(f"Could not find a video ID in {url!r}")
+        metadata = self.get(video_id)
+        if metadata is None or metadata.length is None:
+            metadata = self._fetch(video_id)
+        return metadata
+
+    def lookup_many(self, urls: Iterable[str]) -> Dict[str, VideoMetadata]:
+        """Look up several videos at once.
+
+        IDs are deduplicated and only cache misses hit the network; YouTube has
+        no batch metadata endpoint, so the misses are fetched concurrently.
+        URLs without a video ID are skipped.
+
+        :rtype: dict
+        :returns:
+            Mapping of video ID to metadata for every lookup that succeeded.
+        """
+        results = {}
+        missing = []
+        for url in urls:
+            video_id = parse_video_id(url)
+            if not video_id or video_id in results or video_id in missing:
+                continue
+            metadata = self.get(video_id)
+            if metadata is not None and metadata.length is not None:
+                results[video_id] = metadata
+            else:
+                missing.append(video_id)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as pool:
+                futures = {video_id: pool.submit(self._fetch, video_id) for video_id in missing}
+            for video_id, future in futures.items():
+                try:
+                    results[video_id] = future.result()
+                except Exception as e:
+                    logger.warning("metadata lookup failed for %s: %s", video_id, e)
+        return results
+
+    def youtube(self, url: str) -> YouTube:
+        """Return a ``YouTube`` object for ``url``.
+
+        If a recent lookup already built one, it is handed over (once) so the
+        caller reuses its fetched watch page and player response instead of
+        requesting them again.
+        """
+        video_id = parse_video_id(url)
+        if video_id:
+            with self._lock:
+                entry = self._pages.pop(video_id, None)
+            if entry is not None and entry[0] >= time.monotonic():
+                return entry[1]
+        return YouTube(url)
+
+    def give_back(self, yt: YouTube):
+        """Return an unused object obtained from :meth:`youtube` for the next caller."""
+        self._keep_page(yt.video_id, yt)
+
+    def streams(self, yt: YouTube):
+        """Return ``yt.streams``, loading the player's base.js from the shared cache if possible.
+
+        Deciphering stream URLs needs the player's base.js, which pytube downloads
+        once per process. With a shared cache it is downloaded once per host; a
+        stale copy is harmless because pytube refetches it if deciphering fails.
+        """
+        js_url = None
+        shared_js = None
+        if self.shared is not None and not getattr(yt, "_js", None):
+            try:
+                js_url = yt.js_url
+                shared_js = self.shared.get("player", js_url)
+            except Exception as e:
+                logger.warning("shared player lookup failed for %s: %s", yt.video_id, e)
+            if shared_js:
+                yt._js = shared_js
+        streams = yt.streams
+        self.record_player(yt)
+        if js_url and not shared_js and yt._js_url == js_url:
+            try:
+                self.shared.put("player", js_url, yt.js, self.player_ttl)
+            except Exception as e:
+                logger.warning("shared player write failed for %s: %s", js_url, e)
+        return streams
+
+    def record_player(self, yt: YouTube):
+        """Remember the player version used by ``yt`` once its base.js is known."""
+        version = player_version(getattr(yt, "_js_url", None))
+        if not version:
+            return
+        metadata = self.get(yt.video_id)
+        if metadata is None:
+            metadata = VideoMetadata(yt.video_id)
+        metadata.player_version = version
+        self.put(metadata)
+
+    def _fetch(self, video_id: str) -> VideoMetadata:
+        yt = YouTube(watch_url(video_id))
+        # length and title both come from the same player response
+        metadata = VideoMetadata(
+            video_id,
+            length=yt.length,
+            title=yt.title,
+            player_version=player_version(getattr(yt, "_js_url", None)),
+        )
+        self.put(metadata)
+        self._keep_page(video_id, yt)
+        return metadata
+
+    def _keep_page(self, video_id: str, yt: YouTube):
+        with self._lock:
+            now = time.monotonic()
+            # Drop expired pages, then the oldest, so lookups nobody downloads after don't pin memory
+            for key in [k for k, (expires_at, _) in self._pages.items() if expires_at < now]:
+                del self._pages[key]
+            self._pages.pop(video_id, None)
+            self._pages[video_id] = (now + self.page_ttl, yt)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
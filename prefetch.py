@@ -0,0 +1,167 @@
+"""
+This module contains the preparation of videos before anyone requests them.
+
+Front-ends usually ask for videos we could have predicted: the latest
+uploads of channels we follow, or a list of videos about to be featured.
+Preparing such a video ahead of demand has two levels:
+
+(1) :func:`warm` looks up its metadata and parses the player (cipher) that
+    signs its streams, which makes the first request skip those round trips;
+(2) a :class:`Prefetcher` downloads and transcribes it in the background into
+    the transcript store, so the first request is answered from the store.
+
+:func:`warm_up` runs both lists given in the environment through (1) while
+the Lambda handler initializes.
+
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable, Deque, Iterable, List, Set
+
+from pytube import Channel
+
+from metadata import MetadataCache, parse_video_id, watch_url
+
+logger = logging.getLogger(__name__)
+
+
+def channel_video_urls(channel_url: str, limit: int) -> List[str]:
+    """Watch URLs of the ``limit`` most recent uploads of a channel."""
+    return list(Channel(channel_url).video_urls[:limit])
+
+
+def resolve(urls: Iterable[str], channels: Iterable[str] = (), per_channel: int = 5) -> List[str]:
+    """Expand channels into their latest videos and drop duplicates and non-video URLs.
+
+    Channels that cannot be listed are logged and skipped.
+    """
+    resolved = {}
+    candidates = list(urls)
+    for channel_url in channels:
+        try:
+            candidates.extend(channel_video_urls(channel_url, per_channel))
+        except Exception as e:
+            logger.warning("listing channel %s failed: %s", channel_url, e)
+    for url in candidates:
+        video_id = parse_video_id(url)
+        if video_id and video_id not in resolved:
+            resolved[video_id] = url
+    return list(resolved.values())
+
+
+def warm(metadata: MetadataCache, urls: List[str]) -> int:
+    """Cache the metadata of ``urls`` and parse the current player.
+
+    :rtype: int
+    :returns:
+        How many of the videos were looked up successfully.
+    """
+    found = metadata.lookup_many(urls)
+    # Every video is signed by the current player, so one parsed base.js warms them all
+    for video_id in found:
+        try:
+            yt = metadata.youtube(watch_url(video_id))
+            metadata.streams(yt)
+            metadata.give_back(yt)
+            break
+        except Exception as e:
+            logger.warning("warming the player with %s failed: %s", video_id, e)
+    return len(found)
+
+
+def warm_up(metadata: MetadataCache) -> List[str]:
+    """Warm the videos listed in ``PREFETCH_URLS`` and ``PREFETCH_CHANNELS``.
+
+    Both are comma separated. Meant to run once while the process starts, so
+    it never raises; keep the lists short, since Lambda limits how long a
+    handler may take to initialize.
+
+    :rtype: list
+    :returns:
+        The resolved video URLs, for queueing with a :class:`Prefetcher`.
+    """
+    urls = [url.strip() for url in os.getenv("PREFETCH_URLS", "").split(",") if url.strip()]
+    channels = [url.strip() for url in os.getenv("PREFETCH_CHANNELS", "").split(",") if url.strip()]
+    if not urls and not channels:
+        return []
+    try:
+        urls = resolve(urls, channels, int(os.getenv("PREFETCH_PER_CHANNEL", "5")))
+        logger.info("warmed %d of %d videos at start-up", warm(metadata, urls), len(urls))
+        return urls
+    except Exception as e:
+        logger.warning("warm-up failed: %s", e)
+        return []
+
+
+class Prefetcher:
+    """Background queue of videos to prepare ahead of demand.
+
+    Like the transcription poller, the workers are tasks on the event loop
+    that submitted work, and they exit when the queue is empty.
+
+    :param handle:
+        Coroutine function doing the work for one URL.
+    :param int workers:
+        Videos prepared at the same time.
+    :param int max_queue:
+        URLs submitted while this many are waiting are dropped.
+    """
+
+    def __init__(self, handle: Callable[[str], Awaitable[None]], workers: int = 2, max_queue: int = 500):
+        self.handle = handle
+        self.workers = workers
+        self.max_queue = max_queue
+        self.completed = 0
+        self.failed = 0
+        self._queue: Deque[str] = deque()
+        self._active: Set[str] = set()  # video IDs queued or in progress
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, urls: Iterable[str]) -> int:
+        """Queue the videos that are not queued or in progress already.
+
+        Must be called from the event loop.
+
+        :rtype: int
+        :returns:
+            How many videos were added.
+        """
+        added = 0
+        for url in urls:
+            video_id = parse_video_id(url)
+            if not video_id or video_id in self._active or len(self._queue) >= self.max_queue:
+                continue
+            self._active.add(video_id)
+            self._queue.append(url)
+            added += 1
+        if added:
+            self._ensure_workers()
+        return added
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "in_progress": len(self._active) - len(self._queue),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [task for task in self._tasks if not task.done() and task.get_loop() is loop]
+        while len(self._tasks) < min(self.workers, len(self._queue)):
+            self._tasks.append(loop.create_task(self._run()))
+
+    async def _run(self):
+        while self._queue:
+            url = self._queue.popleft()
+            try:
+                await self.handle(url)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.warning("prefetching %s failed: %s", url, e)
+            finally:
+                self._active.discard(parse_video_id(url))
@@ -0,0 +1,203 @@
+"""
+This module contains opt-in profiling of single requests.
+
+A request's work is spread over the event loop and worker threads, and the
+threads are shared with every other request, so a process-wide profiler
+cannot say where one slow video spent its time. Instead (1) a
+:class:`RequestProfile` is put in a context variable for the duration of the
+request; ``asyncio.to_thread`` and Starlette's thread pool copy the context,
+so it follows the request's work into worker threads; (2) functions
+decorated with :func:`profiled` run under their own ``cProfile`` profiler
+when a profile is active, and merge the result into it together with their
+wall time. The request therefore only pays for profiling when it asked for
+it, and only its own calls are counted.
+
+Memory is traced with tracemalloc from the start to the end of the request.
+tracemalloc is process-wide, so allocations by requests running at the same
+time are included; the top sites still show which code allocated the most.
+
+"""
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per traced allocation
+TRACE_FRAMES = 5
+# Entries kept in a stored report, and shown in the hot-spot summary
+STORED_FUNCTIONS = 40
+STORED_ALLOCATIONS = 15
+HOT_SPOTS = 5
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+_thread = threading.local()  # .active is set while a profiler runs in the thread
+
+_tracing_lock = threading.Lock()
+_tracing_requests = 0
+_tracing_started = False
+
+
+def requested(*flags: Optional[str]) -> bool:
+    """Whether any of the given header or query values asks for profiling."""
+    return any(flag and flag.lower() in ("1", "true", "yes", "on") for flag in flags)
+
+
+def profiled(function: Callable) -> Callable:
+    """Run ``function`` under cProfile when the calling request is being profiled."""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None or getattr(_thread, "active", False):
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 only one profiler can run in the interpreter at a time
+            profiler = None
+        _thread.active = True
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _thread.active = False
+            profile.add(name, time.perf_counter() - started, profiler)
+
+    return wrapper
+
+
+def _start_tracing():
+    global _tracing_requests, _tracing_started
+    with _tracing_lock:
+        if _tracing_requests == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            _tracing_started = True
+        _tracing_requests += 1
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot()
+
+
+def _stop_tracing(before):
+    global _tracing_requests, _tracing_started
+    with _tracing_lock:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _tracing_requests -= 1
+        if _tracing_requests == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    changes = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+    return peak, changes[:STORED_ALLOCATIONS]
+
+
+def module_of(filename: str) -> str:
+    """Group profile entries: the package for installed code, the file name otherwise."""
+    if filename == "~":
+        return "builtins"
+    parts = filename.replace("\\", "/").split("/")
+    if "site-packages" in parts[:-1]:
+        return os.path.splitext(parts[parts.index("site-packages") + 1])[0]
+    return os.path.splitext(parts[-1])[0]
+
+
+def function_label(filename: str, line: int, name: str) -> str:
+    if filename == "~":
+        return name
+    return f"{os.path.basename(os.path.dirname(filename))}/{os.path.basename(filename)}:{line}({name})"
+
+
+class RequestProfile:
+    """Profile of one request, active in its context between ``__enter__`` and ``__exit__``.
+
+    :param str name:
+        What was profiled, e.g. ``POST /process``.
+    """
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.sections = []
+        self.unprofiled_sections = 0
+        self.seconds = None
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+        self._token = None
+        self._snapshot = None
+        self._started = None
+        self._memory = (0, [])
+
+    def add(self, section: str, seconds: float, profiler: Optional[cProfile.Profile]):
+        """Merge a finished section's profiler; ``None`` records only its wall time."""
+        with self._lock:
+            self.sections.append({"name": section, "seconds": round(seconds, 4)})
+            if profiler is None:
+                self.unprofiled_sections += 1
+            elif self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._snapshot = _start_tracing()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._started
+        _current.reset(self._token)
+        self._memory = _stop_tracing(self._snapshot)
+        self._snapshot = None
+
+    def report(self) -> dict:
+        """JSON-ready results: sections, own time per function and module, and allocations."""
+        functions = []
+        modules = {}
+        if self._stats is not None:
+            for (filename, line, name), (_, calls, own, cumulative, _) in self._stats.stats.items():
+                module = module_of(filename)
+                modules[module] = modules.get(module, 0.0) + own
+                functions.append({
+                    "function": function_label(filename, line, name),
+                    "calls": calls,
+                    "own_ms": round(own * 1000, 3),
+                    "cumulative_ms": round(cumulative * 1000, 3),
+                })
+        functions.sort(key=lambda entry: entry["own_ms"], reverse=True)
+        peak, changes = self._memory
+        return {
+            "id": self.id,
+            "name": self.name,
+            "seconds": round(self.seconds or 0.0, 4),
+            "sections": self.sections,
+            "unprofiled_sections": self.unprofiled_sections,
+            "modules_ms": {module: round(own * 1000, 3)
+                           for module, own in sorted(modules.items(), key=lambda item: item[1], reverse=True)},
+            "functions": functions[:STORED_FUNCTIONS],
+            "memory": {
+                "peak_bytes": peak,
+                "allocations": [
+                    {"where": str(change.traceback[0]), "size_bytes": change.size_diff, "count": change.count_diff}
+                    for change in changes
+                ],
+            },
+        }
+
+
+def hot_spots(report: dict) -> str:
+    """One-line summary of a report: the functions with the most own time."""
+    return "; ".join(f"{entry['function']} {entry['own_ms']:.1f}ms" for entry in report["functions"][:HOT_SPOTS])
@@ -0,0 +1,158 @@
+"""
+This module contains the realtime (streaming) transcription path.
+
+Batch transcription returns nothing until the whole video has been
+downloaded, uploaded and processed. For live streams and long videos the
+realtime path instead:
+
+(1) resolves the audio stream URL with yt-dlp (an HLS manifest for live
+    streams),
+(2) has ffmpeg decode it to 16 kHz mono PCM while it downloads, paced at
+    native speed for videos that are not live,
+(3) sends the PCM frames to AssemblyAI's realtime websocket and yields the
+    partial and final transcripts as they come back.
+
+``ASSEMBLYAI_REALTIME_URL`` points the client at another server, e.g.
+``tools/fake_realtime_server.py`` for local testing.
+
+"""
+import asyncio
+import base64
+import json
+import logging
+from typing import AsyncIterator, Optional, Tuple
+from urllib.parse import urlencode
+
+import ffmpeg
+import yt_dlp
+
+try:
+    from websockets.asyncio.client import connect  # websockets >= 13
+    HEADERS_ARGUMENT = "additional_headers"
+except ImportError:
+    from websockets import connect
+    HEADERS_ARGUMENT = "extra_headers"
+
+logger = logging.getLogger(__name__)
+
+REALTIME_URL = "wss://api.assemblyai.com/v2/realtime/ws"
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2  # s16le
+FRAME_MS = 100  # AssemblyAI accepts 100-2000 ms of audio per message
+
+
+class RealtimeError(Exception):
+    """Raised when the realtime service reports an error."""
+
+
+def resolve_audio_url(url: str) -> Tuple[str, bool]:
+    """Find the direct audio URL of a video or live stream.
+
+    :rtype: tuple
+    :returns:
+        The media URL ffmpeg can read and whether the video is live.
+    """
+    with yt_dlp.YoutubeDL({"format": "bestaudio/best", "quiet": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    return info["url"], bool(info.get("is_live"))
+
+
+async def pcm_frames(media_url: str, live: bool = False, sample_rate: int = SAMPLE_RATE,
+                     frame_ms: int = FRAME_MS) -> AsyncIterator[bytes]:
+    """Decode ``media_url`` to mono s16le PCM and yield it in ``frame_ms`` frames.
+
+    Videos that are not live are read at native speed (``-re``): the realtime
+    API expects audio no faster than real time, and it keeps partial
+    transcripts in step with the video.
+    """
+    input_args = {} if live else {"re": None}
+    args = (
+        ffmpeg
+        .input(media_url, **input_args)
+        .audio
+        .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate)
+        .global_args("-loglevel", "error")
+        .compile()
+    )
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.DEVNULL,
+    )
+    frame_bytes = sample_rate * BYTES_PER_SAMPLE * frame_ms // 1000
+    try:
+        while True:
+            try:
+                yield await process.stdout.readexactly(frame_bytes)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    yield e.partial
+                break
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+
+class RealtimeTranscriber:
+    """Client for AssemblyAI's realtime websocket.
+
+    :param str api_key:
+        AssemblyAI API key.
+    :param str url:
+        Websocket endpoint, the AssemblyAI service by default.
+    :param int sample_rate:
+        Sample rate of the PCM frames that will be sent.
+    """
+
+    def __init__(self, api_key: str, url: Optional[str] = None, sample_rate: int = SAMPLE_RATE):
+        self.api_key = api_key
+        self.url = url or REALTIME_URL
+        self.sample_rate = sample_rate
+
+    async def stream(self, frames: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+        """Send ``frames`` and yield transcripts as they arrive.
+
+        Each yielded dict has ``type`` (``partial`` or ``final``), ``text`` and
+        ``start``/``end`` in milliseconds of audio sent. Partial transcripts
+        are revised until the matching final transcript arrives.
+        """
+        url = f"{self.url}?{urlencode({'sample_rate': self.sample_rate})}"
+        headers = {"Authorization": self.api_key}
+        async with connect(url, **{HEADERS_ARGUMENT: headers}) as websocket:
+            sender = asyncio.create_task(self._send(websocket, frames))
+            try:
+                async for raw in websocket:
+                    message = json.loads(raw)
+                    message_type = message.get("message_type")
+                    if message_type in ("PartialTranscript", "FinalTranscript"):
+                        if not message.get("text"):
+                            continue
+                        yield {
+                            "type": "final" if message_type == "FinalTranscript" else "partial",
+                            "text": message["text"],
+                            "start": message.get("audio_start"),
+                            "end": message.get("audio_end"),
+                        }
+                    elif message_type == "SessionTerminated":
+                        break
+                    elif "error" in message:
+                        raise RealtimeError(message["error"])
+                if sender.done() and sender.exception():
+                    raise sender.exception()
+            finally:
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+
+    async def _send(self, websocket, frames: AsyncIterator[bytes]):
+        try:
+            async for frame in frames:
+                await websocket.send(json.dumps({"audio_data": base64.b64encode(frame).decode("ascii")}))
+        except Exception:
+            # Closing the socket ends the receive loop, which then re-raises this error
+            await websocket.close()
+            raise
+        finally:
+            if hasattr(frames, "aclose"):
+                # Stops ffmpeg right away rather than when the generator is collected
+                await frames.aclose()
+        # Ask for the last final transcript; the server answers with SessionTerminated
+        await websocket.send(json.dumps({"terminate_session": True}))
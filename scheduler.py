@@ -0,0 +1,103 @@
+"""
+This module contains the job scheduler that sits in front of ``VideoProcessor``.
+
+Download + transcription time grows roughly linearly with the video length,
+so running admitted jobs first-come-first-served makes a 30 second clip wait
+behind every multi-hour video queued before it. The scheduler hands out a
+fixed number of worker slots shortest-job-first, using the video length as the
+job size, with two adjustments:
+
+(1) aging: every second a job waits counts as ``aging_rate`` seconds off its
+    size, so long videos are never starved by a steady stream of short ones.
+(2) priority classes: a per-caller class shifts the size by a fixed amount,
+    e.g. ``high`` jobs are treated as an hour shorter than they are.
+
+Because aging lowers every waiting job's score at the same rate, the relative
+order of two waiting jobs never changes. Their score at enqueue time plus
+``aging_rate * enqueued_at`` is therefore a valid, constant heap key.
+
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+DEFAULT_PRIORITY_CLASSES = {
+    "high": -3600,
+    "normal": 0,
+    "low": 3600,
+}
+
+
+class JobScheduler:
+    """Shortest-job-first slots with aging.
+
+    :param int workers:
+        Jobs allowed to run at once.
+    :param float aging_rate:
+        Seconds of job size forgiven per second of waiting.
+    :param int default_length:
+        Job size assumed when the video length is unknown.
+    :param dict priority_classes:
+        Mapping of class name to size offset in seconds. Unknown class names
+        are treated as ``normal``.
+    """
+
+    def __init__(self, workers: int, aging_rate: float = 10.0, default_length: int = 600,
+                 priority_classes: Optional[Dict[str, float]] = None):
+        self.workers = workers
+        self.aging_rate = aging_rate
+        self.default_length = default_length
+        self.priority_classes = priority_classes or DEFAULT_PRIORITY_CLASSES
+        self.running = 0
+        self._heap = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, waiter in self._heap if not waiter.done())
+
+    def key(self, length: Optional[int], priority: Optional[str], enqueued_at: float) -> float:
+        """Heap key for a job; smaller runs first."""
+        size = self.default_length if length is None else length
+        offset = self.priority_classes.get(priority, self.priority_classes.get("normal", 0))
+        return size + offset + self.aging_rate * enqueued_at
+
+    @asynccontextmanager
+    async def slot(self, length: Optional[int] = None, priority: Optional[str] = None):
+        """Wait for a worker slot and hold it for the duration of the block.
+
+        :param int length:
+            Video length in seconds, or ``None`` if unknown.
+        :param str priority:
+            Name of the caller's priority class.
+        """
+        if self.running < self.workers and not self.waiting:
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (self.key(length, priority, time.monotonic()), next(self._sequence), waiter)
+            heapq.heappush(self._heap, entry)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as we were cancelled; pass it on
+                    self._release()
+                # Otherwise the cancelled future stays in the heap and is skipped
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._heap:
+            _, _, waiter = heapq.heappop(self._heap)
+            if not waiter.done():
+                # Hand the slot straight to the best waiting job; ``running`` is unchanged
+                waiter.set_result(None)
+                return
+        self.running -= 1
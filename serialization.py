@@ -0,0 +1,73 @@
+"""
+This module contains the conversion of transcripts to JSON response bodies.
+
+An hour of speech is ~10,000 word objects, nested once more inside the
+utterances. Returned as-is, FastAPI runs them through ``jsonable_encoder``,
+which dumps every model to a dict and then walks that dict again checking
+each value against a long list of types, before ``json.dumps`` walks it a
+third time. Here (1) each SDK model class's field names are looked up once
+and cached, (2) models are converted to plain dicts, lists and scalars in a
+single pass, and (3) the result is encoded by orjson in C, via
+:class:`TranscriptResponse`.
+
+"""
+import enum
+from typing import Any, Dict, Tuple
+
+import orjson
+from fastapi.responses import Response
+
+import profiling
+
+# Model class -> ((attribute, key), ...)
+_fields: Dict[type, Tuple[Tuple[str, str], ...]] = {}
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def model_fields(cls: type) -> Tuple[Tuple[str, str], ...]:
+    """``(attribute, key)`` pairs of a pydantic model class, keyed by alias like FastAPI does."""
+    fields = _fields.get(cls)
+    if fields is None:
+        # pydantic v2 exposes model_fields, v1 __fields__; the SDK supports both
+        declared = getattr(cls, "model_fields", None) or getattr(cls, "__fields__", {})
+        fields = tuple((name, getattr(field, "alias", None) or name) for name, field in declared.items())
+        _fields[cls] = fields
+    return fields
+
+
+def plain(value: Any) -> Any:
+    """Convert SDK models, enums and containers to plain JSON-ready values.
+
+    Scalars are returned unchanged. Objects that are not models are converted
+    by their own ``plain()`` method if they have one, as the compact transcript
+    views do, and otherwise from their ``__dict__``, so transcripts built from
+    simple namespaces work too.
+    """
+    if isinstance(value, _SCALARS):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, enum.Enum):
+        return value.value
+    fields = model_fields(type(value))
+    if fields:
+        return {key: plain(getattr(value, name)) for name, key in fields}
+    to_plain = getattr(value, "plain", None)
+    if callable(to_plain):
+        return to_plain()
+    if hasattr(value, "__dict__"):
+        return {key: plain(item) for key, item in vars(value).items() if not key.startswith("_")}
+    return value
+
+
+class TranscriptResponse(Response):
+    """JSON response whose content may contain SDK models; they are made plain before encoding."""
+
+    media_type = "application/json"
+
+    @profiling.profiled
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(plain(content), option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,117 @@
+"""
+This module contains the cache shared by all worker processes on a host.
+
+When the API runs as several processes, each would otherwise keep its own
+metadata cache, download its own copy of the player's base.js and happily
+transcribe a video another process is already working on. :class:`SharedCache`
+is a small SQLite key/value store with expiry (WAL mode, so readers never
+block on the writer) that every process opens at the same path, plus
+expiring leases used to let exactly one process work on a given key.
+
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+# Expired rows are deleted once every this many writes
+PURGE_EVERY = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedCache:
+    """SQLite-backed cache and lease table shared between processes.
+
+    :param str path:
+        Database file; every process must use the same one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the JSON value stored under ``key``, or ``None`` if missing or expired."""
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge()
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease on ``key`` for ``ttl`` seconds.
+
+        :param str owner:
+            Token identifying the holder, unique per piece of work (not per
+            process), so concurrent requests in one process exclude each other too.
+        :rtype: bool
+        :returns:
+            ``True`` if ``owner`` now holds the lease; ``False`` if someone else
+            holds one that has not expired.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT owner, expires_at FROM leases WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now and row[0] != owner:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + ttl),
+            )
+            connection.execute("COMMIT")
+            return True
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def release(self, key: str, owner: str):
+        self._connection().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner)
+        )
+
+    def purge(self):
+        """Delete expired entries and leases."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        connection.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
@@ -0,0 +1,192 @@
+"""
+This module contains the per-video record of uploads and transcripts.
+
+Asking for a different analysis of a video that was already transcribed
+(plain text first, entities later) used to repeat the download, the upload
+and the transcription. :class:`TranscriptStore` remembers, per video:
+
+(1) the AssemblyAI URL of the uploaded audio, so a new analysis can be
+    submitted against it without downloading or uploading again, and
+(2) the ID and feature set of every transcript made, so a request whose
+    features are covered by an existing transcript just fetches it.
+
+Both records carry the offset segments of a silence-trimmed or windowed
+upload, so transcripts fetched later are mapped back to video time like
+fresh ones. A time window of a video is recorded under its own key (see
+:func:`window_key`), separately from the whole video, and audio that was
+silence-trimmed or re-encoded before upload is recorded under a key naming
+that preprocessing (see :func:`upload_key`), so a request only reuses an
+upload made the way it would have made it.
+
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+# Features a transcript can be asked for; "text" is part of every transcript.
+TEXT = "text"
+ENTITIES = "entities"
+SPEAKERS = "speakers"
+CHAPTERS = "chapters"
+SUMMARY = "summary"
+FEATURES = (TEXT, ENTITIES, SPEAKERS, CHAPTERS, SUMMARY)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    video_id TEXT PRIMARY KEY,
+    upload_url TEXT NOT NULL,
+    segments TEXT,
+    uploaded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transcripts (
+    transcript_id TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    features TEXT NOT NULL,
+    segments TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_by_video ON transcripts (video_id);
+"""
+
+
+def feature_set(features: Iterable[str]) -> FrozenSet[str]:
+    """Normalize requested features; ``text`` is always included."""
+    features = frozenset(features) | {TEXT}
+    unknown = features - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+    return features
+
+
+def window_key(video_id: Optional[str], start: Optional[float] = None,
+               end: Optional[float] = None) -> Optional[str]:
+    """Key under which a time window of a video is stored; the whole video keeps its ID.
+
+    **Example**:
+
+    >>> window_key('dQw4w9WgXcQ', 2400, 3300)
+    'dQw4w9WgXcQ@2400-3300'
+    """
+    if not video_id or (not start and end is None):
+        return video_id
+    return f"{video_id}@{start or 0:g}-{'' if end is None else format(end, 'g')}"
+
+
+def window_video(key: Optional[str]) -> Optional[str]:
+    """The video ID a window key was made from (see :func:`window_key`).
+
+    **Example**:
+
+    >>> window_video('dQw4w9WgXcQ@2400-3300')
+    'dQw4w9WgXcQ'
+    """
+    return key.split("@", 1)[0] if key else key
+
+
+def upload_key(video_id: Optional[str], trim_silence: bool = False,
+               compact_audio: bool = False) -> Optional[str]:
+    """Key under which an upload of a video (or window) is stored, naming its preprocessing.
+
+    **Example**:
+
+    >>> upload_key('dQw4w9WgXcQ@2400-3300', trim_silence=True)
+    'dQw4w9WgXcQ@2400-3300+trimmed'
+    """
+    if not video_id:
+        return video_id
+    return video_id + ("+trimmed" if trim_silence else "") + ("+compact" if compact_audio else "")
+
+
+def encode_segments(segments: Optional[List[Tuple[float, float]]]) -> Optional[str]:
+    return json.dumps(segments) if segments else None
+
+
+def decode_segments(value: Optional[str]) -> Optional[List[Tuple[float, float]]]:
+    return [tuple(segment) for segment in json.loads(value)] if value else None
+
+
+class TranscriptStore:
+    """SQLite record of uploads and transcripts per video.
+
+    :param str path:
+        Database file; created on first use.
+    :param int upload_ttl:
+        Seconds an upload URL is reused. Uploaded audio is not kept by
+        AssemblyAI forever, and a stale URL makes the transcription fail.
+    """
+
+    def __init__(self, path: str, upload_ttl: int = 24 * 3600):
+        self.path = path
+        self.upload_ttl = upload_ttl
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def find_transcript(self, video_id: str, features: Iterable[str]):
+        """Return ``(transcript_id, segments)`` of the newest transcript covering ``features``."""
+        wanted = feature_set(features)
+        rows = self._connection().execute(
+            "SELECT transcript_id, features, segments FROM transcripts "
+            "WHERE video_id = ? ORDER BY created_at DESC",
+            (video_id,),
+        ).fetchall()
+        for transcript_id, stored, segments in rows:
+            if wanted <= set(stored.split(",")):
+                return transcript_id, decode_segments(segments)
+        return None
+
+    def add_transcript(self, video_id: str, transcript_id: str, features: Iterable[str],
+                       segments: Optional[List[Tuple[float, float]]] = None):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO transcripts (transcript_id, video_id, features, segments, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (transcript_id, video_id, ",".join(sorted(feature_set(features))),
+                 encode_segments(segments), time.time()),
+            )
+
+    def forget_transcript(self, transcript_id: str):
+        """Drop a transcript that can no longer be fetched (e.g. deleted upstream)."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM transcripts WHERE transcript_id = ?", (transcript_id,))
+
+    def find_upload(self, video_id: str):
+        """Return ``(upload_url, segments)`` if the video's audio was uploaded recently.
+
+        :param str video_id:
+            The :func:`upload_key` of the video.
+        """
+        row = self._connection().execute(
+            "SELECT upload_url, segments FROM uploads WHERE video_id = ? AND uploaded_at > ?",
+            (video_id, time.time() - self.upload_ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], decode_segments(row[1])
+
+    def add_upload(self, video_id: str, upload_url: str,
+                   segments: Optional[List[Tuple[float, float]]] = None):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO uploads (video_id, upload_url, segments, uploaded_at) "
+                "VALUES (?, ?, ?, ?)",
+                (video_id, upload_url, encode_segments(segments), time.time()),
+            )
+
+    def forget_upload(self, video_id: str):
+        """Drop an upload whose transcription failed, so the next request uploads afresh."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM uploads WHERE video_id = ?", (video_id,))
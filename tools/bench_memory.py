@@ -0,0 +1,150 @@
+"""
+Benchmark the memory a long transcript takes as SDK objects and as a compact transcript.
+
+Builds a synthetic multi-hour transcript from the AssemblyAI SDK's own models
+the way the SDK parses a response (every utterance has its own copies of its
+words, and every text is a separate string), then measures with tracemalloc,
+for the SDK objects and for a :class:`compact.CompactTranscript` made from them:
+
+- ``retained``: memory held by the transcript while a request uses it;
+- ``detection``: peak memory of the lists /detection builds from it;
+- ``process``: peak memory and time of encoding the /process response.
+
+It also checks that both give the same /process body.
+
+Usage::
+
+    python tools/bench_memory.py
+    python tools/bench_memory.py --hours 6 --json
+
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assemblyai.types import Entity, EntityType, Utterance, Word  # noqa: E402
+
+from compact import CompactTranscript  # noqa: E402
+from serialization import TranscriptResponse, plain  # noqa: E402
+
+WORDS_PER_MINUTE = 150
+WORDS_PER_UTTERANCE = 30
+WORDS_PER_ENTITY = 50
+ENTITY_TYPES = [EntityType.person_name, EntityType.organization, EntityType.location]
+
+
+def sdk_transcript(hours):
+    """A completed SDK-shaped transcript of ``hours`` of synthetic speech."""
+    count = int(hours * 60 * WORDS_PER_MINUTE)
+
+    def word(i):
+        return Word(text=f"word{i % 700}", start=i * 400, end=i * 400 + 320, confidence=0.93,
+                    speaker="AB"[i // WORDS_PER_UTTERANCE % 2])
+
+    words = [word(i) for i in range(count)]
+    utterances = []
+    for i in range(0, count, WORDS_PER_UTTERANCE):
+        chunk = [word(j) for j in range(i, min(i + WORDS_PER_UTTERANCE, count))]
+        utterances.append(Utterance(text=" ".join(w.text for w in chunk), start=chunk[0].start,
+                                    end=chunk[-1].end, confidence=0.93, speaker=chunk[0].speaker,
+                                    words=chunk))
+    entities = [Entity(entity_type=ENTITY_TYPES[i % 3], text=f"Entity {i % 97}",
+                       start=words[i].start, end=words[i].end)
+                for i in range(0, count, WORDS_PER_ENTITY)]
+    return SimpleNamespace(id="bench", status="completed", error=None, summary=None, chapters=None,
+                           text=" ".join(w.text for w in words), words=words, utterances=utterances,
+                           entities=entities)
+
+
+def detection(transcript):
+    """The lists /detection returns, built the way the route builds them."""
+    entities = plain(transcript.entities)
+    if isinstance(transcript, CompactTranscript):
+        utterances = transcript.utterances.plain(words=False)
+    else:
+        utterances = plain(transcript.utterances)
+    lists = [list({e["text"] for e in entities if e["entity_type"] == entity_type})
+             for entity_type in ("person_name", "organization", "location")]
+    lists.append(list({f"Speaker {u['speaker']}: {u['text']}" for u in utterances}))
+    lists.append(list({f"Speaker {u['speaker']}" for u in utterances}))
+    lists.append(list({u["start"] for u in utterances}))
+    lists.append(list({u["end"] for u in utterances}))
+    return lists
+
+
+def process(transcript):
+    return TranscriptResponse({"video_url": "bench", "transcript": transcript.text,
+                               "entity": transcript.entities, "utterance": transcript.utterances}).body
+
+
+def peak(function, *args):
+    """Peak bytes allocated by ``function(*args)`` above what was allocated before."""
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    result = function(*args)
+    _, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, top - base
+
+
+def measure(hours, compact):
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    transcript = sdk_transcript(hours)
+    if compact:
+        transcript = CompactTranscript.from_transcript(transcript)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - base
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    _, detection_peak = peak(detection, transcript)
+    body, process_peak = peak(process, transcript)
+    started = time.perf_counter()
+    process(transcript)
+    seconds = time.perf_counter() - started
+    return body, {
+        "retained_bytes": retained,
+        "build_peak_bytes": build_peak - base,
+        "detection_peak_bytes": detection_peak,
+        "process_peak_bytes": process_peak,
+        "process_seconds": seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--hours", type=float, default=3.0, help="length of the synthetic transcript")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    sdk_body, sdk = measure(args.hours, compact=False)
+    compact_body, compact = measure(args.hours, compact=True)
+    if json.loads(sdk_body) != json.loads(compact_body):
+        sys.exit("the compact transcript's /process body differs from the SDK objects'")
+
+    results = {"sdk": sdk, "compact": compact}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    mib = 2 ** 20
+    print(f"{'transcript':<10} {'retained MiB':>13} {'build peak':>11} {'detection':>10} "
+          f"{'process':>8} {'process s':>10}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['retained_bytes'] / mib:>13.1f} {result['build_peak_bytes'] / mib:>11.1f} "
+              f"{result['detection_peak_bytes'] / mib:>10.1f} {result['process_peak_bytes'] / mib:>8.1f} "
+              f"{result['process_seconds']:>10.3f}")
+    print(f"retained: {sdk['retained_bytes'] / compact['retained_bytes']:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""
+Run the cipher and pipeline benchmarks offline and gate on regressions.
+
+Benchmarks:
+
+- ``cipher_init_cold``: ``Cipher(js)`` with the base.js parse caches cleared,
+  i.e. the first video after a player change;
+- ``cipher_init_warm``: ``Cipher(js)`` for every later video of that player;
+- ``calculate_n`` and ``get_signature`` on a fresh ``Cipher``;
+- ``process_new``: ``POST /process`` for a video seen for the first time;
+- ``process_reused``: ``POST /process`` for a video already transcribed;
+- ``search``: ``POST /search`` over the transcripts indexed by the above.
+
+The cipher runs on ``tools/fixtures/base.js``, a synthetic player fragment in
+the shape cipher.py expects, padded to a real player's size (or on any
+captured base.js given with ``--fixture``). The routes run in-process against
+fake YouTube and AssemblyAI services, with the SQLite databases in a
+temporary directory, so nothing touches the network.
+
+Each run is appended to a JSON history and compared against a baseline run.
+The runner exits with status 1 if a benchmark's median is slower than the
+baseline by more than its threshold.
+
+Usage::
+
+    python tools/bench_runner.py --update-baseline     # on the reference commit
+    python tools/bench_runner.py                       # on a change; fails on regressions
+    python tools/bench_runner.py --only cipher_init_cold calculate_n --threshold 0.1
+    python tools/bench_runner.py --fixture captured/base.js --thresholds cipher_init_cold=0.5
+
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metadata  # noqa: E402
+
+FIXTURE = os.path.join(ROOT, "tools", "fixtures", "base.js")
+RESULTS_DIRECTORY = os.path.join(ROOT, "tools", "bench_results")
+
+# A current player's base.js is around 2.5 MB
+FIXTURE_SIZE = 2_500_000
+N_PARAMETER = "V8yKSgZ1a2bMQw"
+SIGNATURE = "".join(chr(48 + (i * 7) % 75) for i in range(104))
+
+# Fake video: length in seconds and words per second of speech
+VIDEO_LENGTH = 600
+WORDS_PER_SECOND = 2.5
+AUDIO_BYTES = 2 * 1024 * 1024
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def load_fixture(path, size):
+    """The fixture, preceded by filler up to ``size`` bytes so every regex scans a realistic file.
+
+    The filler is deterministic and cannot match any of cipher.py's patterns.
+    """
+    with open(path, encoding="utf-8") as f:
+        js = f.read()
+    filler = []
+    length = 0
+    i = 0
+    while length + len(js) < size:
+        line = f'var _p{i}=function(x,y){{return x.length*{i % 97}+y["k{i % 13}"]||"v{i}"}};\n'
+        filler.append(line)
+        length += len(line)
+        i += 1
+    return "".join(filler) + js
+
+
+# Cipher benchmarks: each returns one sample in seconds
+
+
+def clear_parse_caches(cipher_module):
+    for name in ("get_transform_plan", "get_transform_object", "get_throttling_function_code"):
+        cache_clear = getattr(getattr(cipher_module, name), "cache_clear", None)
+        if cache_clear is not None:
+            cache_clear()
+
+
+@benchmark
+def cipher_init_cold(context):
+    cipher = context.cipher
+    clear_parse_caches(cipher)
+    started = time.perf_counter()
+    cipher.Cipher(js=context.js)
+    return time.perf_counter() - started
+
+
+@benchmark
+def cipher_init_warm(context):
+    cipher = context.cipher
+    cipher.Cipher(js=context.js)
+    started = time.perf_counter()
+    cipher.Cipher(js=context.js)
+    return time.perf_counter() - started
+
+
+@benchmark
+def calculate_n(context):
+    instance = context.cipher.Cipher(js=context.js)
+    started = time.perf_counter()
+    instance.calculate_n(list(N_PARAMETER))
+    return time.perf_counter() - started
+
+
+@benchmark
+def get_signature(context):
+    instance = context.cipher.Cipher(js=context.js)
+    started = time.perf_counter()
+    instance.get_signature(SIGNATURE)
+    return time.perf_counter() - started
+
+
+# Pipeline benchmarks: coroutines returning one sample in seconds
+
+
+class FakeServices:
+    """Stands in for YouTube and AssemblyAI inside the app module."""
+
+    def __init__(self, app, aai):
+        self.app = app
+        self.aai = aai
+        self.transcripts = {}
+        self.videos = 0
+
+    def install(self):
+        app, aai, services = self.app, self.aai, self
+
+        class Transcriber:
+            def upload_file(self, data):
+                while data.read(1024 * 1024):
+                    pass
+                return f"https://fake.assemblyai/upload/{os.getpid()}-{len(services.transcripts)}"
+
+            def submit(self, audio, config=None):
+                # Worker processes share the store, so IDs must not repeat across processes
+                transcript_id = f"fake-{os.getpid()}-{len(services.transcripts)}"
+                services.transcripts[transcript_id] = services.transcript(transcript_id)
+                return SimpleNamespace(id=transcript_id, status=aai.TranscriptStatus.queued)
+
+        class Transcript:
+            @staticmethod
+            def get_by_id(transcript_id):
+                return services.transcripts[transcript_id]
+
+        aai.Transcriber = Transcriber
+        aai.Transcript = Transcript
+
+        processor = app.video_processor
+        # The fake finishes at once, so poll right away instead of after the duration estimate
+        processor.transcriber.poll_schedule = lambda duration: (0.0, 0.001)
+
+        def save_audio_buffer(url):
+            buffer = app.AudioBuffer.allocate(AUDIO_BYTES, processor.buffer_budget, processor.buffer_mmap_bytes)
+            buffer.write(bytes(AUDIO_BYTES))
+            return buffer
+        processor.save_audio_buffer = save_audio_buffer
+
+        # Measure the pipeline, not the rate limits
+        unlimited = app.RouteLimits(rate=1e9, burst=1e9, client_rate=1e9, client_burst=1e9,
+                                    max_concurrent=1000, max_queue=1000)
+        app.admission = app.AdmissionController({route: unlimited for route in app.admission.limits})
+
+    def new_video(self):
+        video_id = f"bench{self.videos:06d}"
+        self.videos += 1
+        self.app.video_processor.metadata.put(
+            metadata.VideoMetadata(video_id, length=VIDEO_LENGTH, title=video_id))
+        return f"https://www.youtube.com/watch?v={video_id}"
+
+    def transcript(self, transcript_id):
+        count = int(VIDEO_LENGTH * WORDS_PER_SECOND)
+        words = [SimpleNamespace(text=f"word{i % 400}", start=i * 400, end=i * 400 + 300,
+                                 confidence=0.9, speaker="AB"[i // 30 % 2])
+                 for i in range(count)]
+        utterances = [SimpleNamespace(text=" ".join(w.text for w in words[i:i + 30]), start=words[i].start,
+                                      end=words[min(i + 29, count - 1)].end, confidence=0.9,
+                                      speaker=words[i].speaker, words=words[i:i + 30])
+                      for i in range(0, count, 30)]
+        entities = [SimpleNamespace(text=f"Entity {i % 31}", entity_type="organization",
+                                    start=words[i].start, end=words[i].end)
+                    for i in range(0, count, 50)]
+        return SimpleNamespace(id=transcript_id, status=self.aai.TranscriptStatus.completed,
+                               text=" ".join(w.text for w in words), words=words,
+                               utterances=utterances, entities=entities, chapters=None, summary=None)
+
+
+async def request(app, path, body):
+    """Send one JSON POST straight to the ASGI app; returns ``(status, body)``."""
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    received = False
+    messages = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+async def timed_request(context, path, body):
+    started = time.perf_counter()
+    status, response = await request(context.app.app, path, body)
+    elapsed = time.perf_counter() - started
+    if status != 200:
+        raise RuntimeError(f"{path} returned {status}: {response[:200]!r}")
+    return elapsed
+
+
+@benchmark
+async def process_new(context):
+    return await timed_request(context, "/process", {"url": context.services.new_video()})
+
+
+@benchmark
+async def process_reused(context):
+    if context.reused_url is None:
+        context.reused_url = context.services.new_video()
+        await request(context.app.app, "/process", {"url": context.reused_url})
+    return await timed_request(context, "/process", {"url": context.reused_url})
+
+
+@benchmark
+async def search(context):
+    if context.services.videos == 0:
+        await request(context.app.app, "/process", {"url": context.services.new_video()})
+    return await timed_request(context, "/search", {"query": "word17 word42", "limit": 20})
+
+
+def load_app(directory):
+    for variable in ("TRANSCRIPT_INDEX_PATH", "TRANSCRIPT_STORE_PATH", "SHARED_CACHE_PATH"):
+        os.environ[variable] = os.path.join(directory, f"{variable.lower()}.db")
+    os.environ.setdefault("ASSEMBLYAI_API_KEY", "offline")
+    for variable in ("PREFETCH_URLS", "PREFETCH_CHANNELS", "ASSEMBLYAI_WEBHOOK_URL"):
+        os.environ.pop(variable, None)
+    import assemblyai as aai
+    import app
+    services = FakeServices(app, aai)
+    services.install()
+    return app, services
+
+
+def run(names, iterations, fixture, size):
+    import cipher
+
+    with tempfile.TemporaryDirectory() as directory:
+        context = SimpleNamespace(cipher=cipher, js=load_fixture(fixture, size), reused_url=None)
+        if any(asyncio.iscoroutinefunction(BENCHMARKS[name]) for name in names):
+            context.app, context.services = load_app(directory)
+
+        async def sample_all():
+            results = {}
+            for name in names:
+                function = BENCHMARKS[name]
+                samples = []
+                # One untimed run first, so imports and lazily opened connections are not measured
+                for _ in range(iterations + 1):
+                    sample = function(context)
+                    if asyncio.iscoroutine(sample):
+                        sample = await sample
+                    samples.append(sample)
+                results[name] = summarize(samples[1:])
+            return results
+
+        # The routes print every URL they handle
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return asyncio.run(sample_all())
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "iterations": len(ordered),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold, thresholds, min_delta_ms):
+    """Rows of ``(name, baseline_ms, median_ms, change, regressed)`` for every benchmark in both runs."""
+    rows = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            rows.append((name, None, result["median_ms"], None, False))
+            continue
+        change = result["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        regressed = (change > thresholds.get(name, threshold)
+                     and result["median_ms"] - base["median_ms"] > min_delta_ms)
+        rows.append((name, base["median_ms"], result["median_ms"], change, regressed))
+    return rows
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        name, _, limit = value.partition("=")
+        if name not in BENCHMARKS or not limit:
+            raise argparse.ArgumentTypeError(f"expected <benchmark>=<fraction>, got {value!r}")
+        thresholds[name] = float(limit)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--iterations", type=int, default=20, help="timed samples per benchmark")
+    parser.add_argument("--fixture", default=FIXTURE, help="base.js to run the cipher on")
+    parser.add_argument("--fixture-size", type=int, default=FIXTURE_SIZE,
+                        help="pad the fixture with filler up to this many bytes")
+    parser.add_argument("--history", default=os.path.join(RESULTS_DIRECTORY, "history.json"))
+    parser.add_argument("--baseline", default=os.path.join(RESULTS_DIRECTORY, "baseline.json"))
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown of a median against the baseline, as a fraction")
+    parser.add_argument("--thresholds", nargs="+", default=[], metavar="NAME=FRACTION",
+                        help="per-benchmark overrides of --threshold")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="slowdowns smaller than this are noise, whatever the fraction")
+    args = parser.parse_args()
+
+    try:
+        thresholds = parse_thresholds(args.thresholds)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    names = args.only or list(BENCHMARKS)
+
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "fixture": os.path.relpath(args.fixture, ROOT),
+        "fixture_size": args.fixture_size,
+        "results": run(names, args.iterations, args.fixture, args.fixture_size),
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history, encoding="utf-8") as f:
+            history = json.load(f)
+    history.append(record)
+    with open(args.history, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    rows = compare(record["results"], baseline or {}, args.threshold, thresholds, args.min_delta_ms)
+
+    print(f"{'benchmark':<18} {'baseline ms':>12} {'median ms':>10} {'p95 ms':>9} {'change':>8}")
+    for name, base, median, change, regressed in rows:
+        print(f"{name:<18} {'-' if base is None else f'{base:.3f}':>12} {median:>10.3f} "
+              f"{record['results'][name]['p95_ms']:>9.3f} "
+              f"{'-' if change is None else f'{change:+.0%}':>8}{'  REGRESSION' if regressed else ''}")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+    elif baseline is None:
+        print(f"no baseline at {args.baseline}; run with --update-baseline to record one")
+
+    if any(regressed for *_, regressed in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
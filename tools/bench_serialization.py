@@ -0,0 +1,114 @@
+"""
+Benchmark encoding a /process response for a multi-hour transcript.
+
+Builds a synthetic transcript from the AssemblyAI SDK's own models (words,
+utterances with nested words, entities) and encodes the /process response
+body two ways:
+
+- ``jsonable_encoder``: what FastAPI does with a returned dict, i.e.
+  ``jsonable_encoder`` followed by ``JSONResponse``'s ``json.dumps``;
+- ``TranscriptResponse``: single-pass conversion to plain values, encoded by orjson.
+
+For each it reports the best wall time over ``--repeat`` runs and the peak
+memory allocated while encoding (measured with tracemalloc in a separate run,
+since tracing slows everything down), and checks both bodies decode to the
+same JSON.
+
+Usage::
+
+    python tools/bench_serialization.py
+    python tools/bench_serialization.py --hours 6 --repeat 5
+
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assemblyai.types import Entity, EntityType, Utterance, Word  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from serialization import TranscriptResponse  # noqa: E402
+
+WORDS_PER_MINUTE = 150
+WORDS_PER_UTTERANCE = 30
+WORDS_PER_ENTITY = 50
+ENTITY_TYPES = [EntityType.person_name, EntityType.organization, EntityType.location]
+
+
+def fixture(hours):
+    """The /process response body for ``hours`` of synthetic speech."""
+    count = int(hours * 60 * WORDS_PER_MINUTE)
+    words = [Word(text=f"word{i % 700}", start=i * 400, end=i * 400 + 320, confidence=0.93,
+                  speaker="AB"[i // WORDS_PER_UTTERANCE % 2])
+             for i in range(count)]
+    utterances = []
+    for i in range(0, count, WORDS_PER_UTTERANCE):
+        chunk = words[i:i + WORDS_PER_UTTERANCE]
+        utterances.append(Utterance(text=" ".join(w.text for w in chunk), start=chunk[0].start,
+                                    end=chunk[-1].end, confidence=0.93, speaker=chunk[0].speaker,
+                                    words=chunk))
+    entities = [Entity(entity_type=ENTITY_TYPES[i % 3], text=f"Entity {i % 97}",
+                       start=words[i].start, end=words[i].end)
+                for i in range(0, count, WORDS_PER_ENTITY)]
+    return {
+        "video_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "transcript": " ".join(w.text for w in words),
+        "entity": entities,
+        "utterance": utterances,
+    }
+
+
+def encode_default(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def encode_fast(content):
+    return TranscriptResponse(content).body
+
+
+def measure(encode, content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode(content)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    encode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, {"seconds": best, "peak_bytes": peak, "body_bytes": len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--hours", type=float, default=3.0, help="length of the synthetic transcript")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per encoder; the best is kept")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    content = fixture(args.hours)
+    default_body, default = measure(encode_default, content, args.repeat)
+    fast_body, fast = measure(encode_fast, content, args.repeat)
+    if json.loads(default_body) != json.loads(fast_body):
+        sys.exit("TranscriptResponse body differs from jsonable_encoder's")
+
+    results = {"jsonable_encoder": default, "TranscriptResponse": fast}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'encoder':<20} {'seconds':>9} {'peak MiB':>9} {'body MiB':>9}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['seconds']:>9.3f} {result['peak_bytes'] / 2**20:>9.1f} "
+              f"{result['body_bytes'] / 2**20:>9.1f}")
+    print(f"speedup: {default['seconds'] / fast['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark the compact upload formats against uploading the original audio.
+
+For every setting this records the bytes that would be uploaded and the time
+ffmpeg needs to produce them. With ``--upload`` it also uploads each variant
+to AssemblyAI and, with ``--transcribe``, transcribes it and reports the
+end-to-end latency and the word error rate against the transcript of the
+original file, so a setting can be checked for being accuracy-neutral.
+
+Usage::
+
+    python tools/bench_transcode.py audio.m4a
+    ASSEMBLYAI_API_KEY=... python tools/bench_transcode.py audio.m4a --upload --transcribe
+
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio  # noqa: E402
+
+SETTINGS = [
+    ("original", None, None),
+    ("opus-16k", "opus", 16000),
+    ("flac-16k", "flac", 16000),
+]
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref = (reference or "").lower().split()
+    hyp = (hypothesis or "").lower().split()
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1] / max(len(ref), 1)
+
+
+def measure(path, codec, sample_rate, upload, transcribe):
+    import assemblyai as aai
+
+    result = {}
+    started = time.perf_counter()
+    if codec is None:
+        result["bytes"] = os.path.getsize(path)
+    else:
+        # Drain the stream once to time ffmpeg on its own; the upload below re-runs it
+        with audio.TranscodedStream(path, codec, sample_rate) as stream:
+            while stream.read(audio.PIPE_CHUNK_SIZE):
+                pass
+            result["bytes"] = stream.bytes_read
+        result["transcode_seconds"] = time.perf_counter() - started
+    if not upload:
+        return result
+
+    started = time.perf_counter()
+    data = open(path, "rb") if codec is None else audio.TranscodedStream(path, codec, sample_rate)
+    with data:
+        upload_url = aai.Transcriber().upload_file(data)
+    result["upload_seconds"] = time.perf_counter() - started
+
+    if transcribe:
+        transcript = aai.Transcriber().transcribe(upload_url)
+        result["end_to_end_seconds"] = time.perf_counter() - started
+        result["text"] = transcript.text
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("audio_file")
+    parser.add_argument("--upload", action="store_true", help="upload each variant to AssemblyAI")
+    parser.add_argument("--transcribe", action="store_true", help="also transcribe each upload")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.upload or args.transcribe:
+        import assemblyai as aai
+        aai.settings.api_key = os.environ["ASSEMBLYAI_API_KEY"]
+
+    results = {}
+    for name, codec, sample_rate in SETTINGS:
+        results[name] = measure(args.audio_file, codec, sample_rate, args.upload or args.transcribe,
+                                args.transcribe)
+
+    reference = results["original"].get("text")
+    print(f"{'setting':<10} {'bytes':>12} {'ratio':>7} {'transcode':>10} {'upload':>8} {'e2e':>8} {'wer':>6}")
+    for name, result in results.items():
+        if reference is not None and name != "original":
+            result["wer_vs_original"] = word_error_rate(reference, result.get("text"))
+        ratio = result["bytes"] / results["original"]["bytes"]
+        print(f"{name:<10} {result['bytes']:>12} {ratio:>7.3f} "
+              f"{result.get('transcode_seconds', 0):>9.2f}s "
+              f"{result.get('upload_seconds', 0):>7.2f}s "
+              f"{result.get('end_to_end_seconds', 0):>7.2f}s "
+              f"{result.get('wer_vs_original', 0):>6.3f}")
+
+    if args.json:
+        for result in results.values():
+            result.pop("text", None)
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark /process throughput of the ``WORKERS=N`` deployment for several N.
+
+One worker process runs every request's Python code under a single GIL, so
+the CPU-bound part of a request (building the compact transcript, indexing
+it, encoding the response) does not get faster with more threads. This
+starts uvicorn with N worker processes, the way ``WORKERS=N python app.py``
+does, against the offline YouTube and AssemblyAI fakes of
+``tools/bench_runner.py``, with every worker sharing one set of SQLite
+databases in a temporary directory. It then sends ``/process`` requests for
+new videos from concurrent keep-alive connections and prints requests per
+second for each N, and the speedup over the first.
+
+Scaling can only be near-linear up to the number of cores; the CPU count is
+printed with the results.
+
+Usage::
+
+    python tools/bench_workers.py
+    python tools/bench_workers.py --workers 1 2 4 8 --requests 400 --connections 32
+
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS))
+
+import bench_runner  # noqa: E402
+import metadata  # noqa: E402
+
+# Seconds to wait for the workers to accept connections
+STARTUP_TIMEOUT = 60
+
+
+def create_app():
+    """uvicorn app factory run in each worker: the app with its external services faked."""
+    bench_runner.VIDEO_LENGTH = int(os.environ.get("BENCH_VIDEO_LENGTH", bench_runner.VIDEO_LENGTH))
+    app, _ = bench_runner.load_app(os.environ["BENCH_DIRECTORY"])
+
+    # Every worker sees new videos, so the metadata lookup is faked rather than pre-filled
+    def fetch(video_id):
+        found = metadata.VideoMetadata(video_id, length=bench_runner.VIDEO_LENGTH, title=video_id)
+        app.video_processor.metadata.put(found)
+        return found
+    app.video_processor.metadata._fetch = fetch
+    return app.app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def post(reader, writer, path, body):
+    """One JSON POST on a keep-alive connection; returns the status."""
+    payload = json.dumps(body).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in head[1:] if ": " in line)
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    return int(head[0].split(" ", 2)[1])
+
+
+async def wait_until_up(port):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"uvicorn did not start on port {port}")
+            await asyncio.sleep(0.2)
+
+
+async def load(port, requests, connections, prefix):
+    """Send ``requests`` /process calls over ``connections`` connections; returns seconds taken."""
+    counter = iter(range(requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for n in counter:
+                # A new 11-character video ID for every request, so nothing is reused
+                status = await post(reader, writer, "/process",
+                                    {"url": f"https://www.youtube.com/watch?v={prefix}{n:08d}"})
+                if status != 200:
+                    raise RuntimeError(f"/process returned {status}")
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return time.perf_counter() - started
+
+
+def run(workers, requests, connections, video_length):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        # WORKERS splits MAX_CONCURRENT_JOBS between the processes, as in a deployment
+        env = dict(os.environ, BENCH_DIRECTORY=directory, BENCH_VIDEO_LENGTH=str(video_length),
+                   MAX_CONCURRENT_JOBS=str(connections), WORKERS=str(workers))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "bench_workers:create_app", "--factory",
+             "--app-dir", TOOLS, "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(wait_until_up(port))
+            # Warm every worker up (imports, SQLite connections) before timing
+            asyncio.run(load(port, workers * connections, connections, f"w{workers:02d}"))
+            seconds = asyncio.run(load(port, requests, connections, f"b{workers:02d}"))
+        finally:
+            server.terminate()
+            server.wait()
+    return requests / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200, help="timed /process requests per measurement")
+    parser.add_argument("--connections", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--video-length", type=int, default=bench_runner.VIDEO_LENGTH,
+                        help="seconds of speech in each fake transcript")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [{"workers": workers,
+                "requests_per_s": run(workers, args.requests, args.connections, args.video_length)}
+               for workers in args.workers]
+
+    if args.json:
+        print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+        return
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'requests/s':>11} {'speedup':>8}")
+    base = results[0]["requests_per_s"]
+    for result in results:
+        print(f"{result['workers']:>8} {result['requests_per_s']:>11.2f} "
+              f"{result['requests_per_s'] / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
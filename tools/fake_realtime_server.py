@@ -0,0 +1,104 @@
+"""
+Local stand-in for AssemblyAI's realtime websocket.
+
+Speaks the same message protocol as the real service: it answers every
+``audio_data`` message with a growing ``PartialTranscript`` and emits a
+``FinalTranscript`` for each second of audio received, with ``audio_start``
+and ``audio_end`` derived from the number of PCM bytes sent. The words are
+fake ("word1 word2 ..."), so timing and message flow can be exercised
+without an API key or network access.
+
+Usage::
+
+    python tools/fake_realtime_server.py --port 8765
+    ASSEMBLYAI_REALTIME_URL=ws://localhost:8765 uvicorn app:app
+
+"""
+import argparse
+import asyncio
+import base64
+import json
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+
+BYTES_PER_SAMPLE = 2
+WORDS_PER_SECOND = 2
+
+
+def request_path(websocket, path):
+    if path is not None:
+        return path
+    # websockets >= 13 passes only the connection
+    return websocket.request.path
+
+
+async def session(websocket, path=None):
+    query = parse_qs(urlparse(request_path(websocket, path)).query)
+    sample_rate = int(query.get("sample_rate", ["16000"])[0])
+    bytes_per_second = sample_rate * BYTES_PER_SAMPLE
+
+    await websocket.send(json.dumps({
+        "message_type": "SessionBegins",
+        "session_id": str(uuid.uuid4()),
+    }))
+
+    received = 0  # PCM bytes received so far
+    final_until = 0  # bytes already covered by a final transcript
+    word_count = 0
+    async for raw in websocket:
+        message = json.loads(raw)
+        if message.get("terminate_session"):
+            break
+        received += len(base64.b64decode(message["audio_data"]))
+
+        start_ms = final_until * 1000 // bytes_per_second
+        end_ms = received * 1000 // bytes_per_second
+        words = [f"word{word_count + i + 1}"
+                 for i in range(max(1, (end_ms - start_ms) * WORDS_PER_SECOND // 1000))]
+        if received - final_until >= bytes_per_second:
+            await websocket.send(json.dumps({
+                "message_type": "FinalTranscript",
+                "text": " ".join(words),
+                "audio_start": start_ms,
+                "audio_end": end_ms,
+            }))
+            word_count += len(words)
+            final_until = received
+        else:
+            await websocket.send(json.dumps({
+                "message_type": "PartialTranscript",
+                "text": " ".join(words),
+                "audio_start": start_ms,
+                "audio_end": end_ms,
+            }))
+
+    if received > final_until:
+        start_ms = final_until * 1000 // bytes_per_second
+        end_ms = received * 1000 // bytes_per_second
+        await websocket.send(json.dumps({
+            "message_type": "FinalTranscript",
+            "text": f"word{word_count + 1}",
+            "audio_start": start_ms,
+            "audio_end": end_ms,
+        }))
+    await websocket.send(json.dumps({"message_type": "SessionTerminated"}))
+
+
+async def serve(host, port):
+    async with websockets.serve(session, host, port):
+        print(f"Fake realtime server listening on ws://{host}:{port}")
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+// Synthetic player fragment for tools/bench_runner.py. It has the shape
+// cipher.py's regexes expect from a real base.js: a signature function, its
+// transform object, and an "n" throttling function with its c array. The
+// runner surrounds it with filler to bring it to a real player's size.
+var XY={AJ:function(a){a.reverse()},
+VR:function(a,b){a.splice(0,b)},
+kT:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c}};
+Hy=function(a){a=a.split("");XY.kT(a,51);XY.AJ(a,15);XY.VR(a,3);XY.kT(a,21);XY.AJ(a,8);XY.VR(a,2);return a.join("")};
+var Bpa=[Nq];
+g.k.Lf=function(a){a.D&&(b=a.get("n"))&&(b=Bpa[0](b),a.set("n",b),Bpa.length||Nq(""))};
+Nq=function(a){var b=a.split(""),c=[function(d,e){d.push(e)},-1238774045,"ZmFrZQ",null,function(d){d.reverse()},b,function(d,e){e=(e%d.length+d.length)%d.length;d.splice(0,1,d.splice(e,1,d[0])[0])},1917432765,function(d,e){for(e=(e%d.length+d.length)%d.length;e--;)d.unshift(d.pop())},-618129427,function(d,e){e=(e%d.length+d.length)%d.length;var f=d[0];d[0]=d[e];d[e]=f},"cGxheWVy",function(d,e){e=(e%d.length+d.length)%d.length;d.splice(e,1)},function(d,e){e=(e%d.length+d.length)%d.length;d.splice(-e).reverse().forEach(function(f){d.unshift(f)})},function(d,e){for(var f=64,h=[];++f-h.length-32;){switch(f){case 58:f=96;continue;case 91:f=44;break;case 65:f=47;continue;case 46:f=153;case 123:f-=58;default:h.push(String.fromCharCode(f))}}d.forEach(function(l,m,n){this.push(n[m]=h[(h.indexOf(l)-h.indexOf(this[m])+m-32+f--)%h.length])},e.split(""))}];c[3]=c;try{c[4](c[5]),c[6](c[5],c[1]),c[8](c[5],c[7]),c[10](c[5],c[9]),c[14](c[5],c[2]),c[12](c[5],c[1]),c[0](c[3],c[11]),c[13](c[5],c[7]),c[14](c[5],c[11]),c[6](c[5],c[9]),c[4](c[5])}catch(d){return"enhanced_except_"+a}return b.join("")};
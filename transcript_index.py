@@ -0,0 +1,312 @@
+"""
+This module contains the full-text search index over produced transcripts.
+
+Transcripts are split into utterances (or, without speaker labels, into
+fixed-size runs of words) and stored in an SQLite FTS5 table together with
+their video ID, speaker and timestamps, so a keyword search returns ranked
+``(video, speaker, start, end)`` hits straight from the index instead of
+refetching and scanning every transcript.
+
+Detected entities are kept in a second, ordinary table keyed by their
+normalized text, so "which videos mention X, and when" is an index lookup
+that is updated per transcript without rescanning older ones.
+
+A transcript of a time window is indexed under its video's ID too, marked
+partial: it replaces an earlier window of the video, but never a transcript
+of the whole video, which in turn replaces any window.
+
+The database lives at ``TRANSCRIPT_INDEX_PATH``; on Lambda point this at an
+EFS mount, since ``/tmp`` does not outlive the container.
+
+"""
+import bisect
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Without utterances, consecutive words are indexed in runs of this many
+WORDS_PER_CHUNK = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    indexed_at REAL NOT NULL,
+    first_rowid INTEGER,
+    last_rowid INTEGER,
+    partial INTEGER NOT NULL DEFAULT 0
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS utterances USING fts5(
+    text,
+    video_id UNINDEXED,
+    speaker UNINDEXED,
+    start UNINDEXED,
+    "end" UNINDEXED,
+    tokenize = 'porter unicode61'
+);
+CREATE TABLE IF NOT EXISTS entities (
+    normalized TEXT NOT NULL,
+    entity_type TEXT NOT NULL,
+    text TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    start INTEGER,
+    "end" INTEGER,
+    speaker TEXT
+);
+DROP INDEX IF EXISTS entities_by_text;
+CREATE INDEX IF NOT EXISTS entities_by_text_video ON entities (normalized, entity_type, video_id, start);
+CREATE INDEX IF NOT EXISTS entities_by_video ON entities (video_id);
+"""
+
+POSSESSIVE_REGEX = re.compile(r"['\u2019]s\b")
+PUNCTUATION_REGEX = re.compile(r"[^\w\s&-]+")
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching all of its words.
+
+    Every word is quoted, so FTS5 operators and punctuation typed by a user
+    are searched for literally instead of causing syntax errors. A trailing
+    ``*`` on a word is kept as a prefix search.
+
+    **Example**:
+
+    >>> match_expression('OpenAI board, "Altman"')
+    '"openai" "board" "altman"'
+    """
+    terms = []
+    for match in re.finditer(r"(\w+)(\*?)", query.lower(), re.UNICODE):
+        word, prefix = match.groups()
+        terms.append(f'"{word}"{prefix}')
+    return " ".join(terms) or None
+
+
+def normalize_entity(text: str) -> str:
+    """Normalize entity text so spelling variants share one index key.
+
+    Unicode compatibility forms are folded, case and possessives dropped,
+    punctuation other than ``&`` and ``-`` removed, whitespace collapsed and
+    a leading "the" stripped.
+
+    **Example**:
+
+    >>> normalize_entity("The  U.N.'s")
+    'un'
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = POSSESSIVE_REGEX.sub("", text)
+    text = PUNCTUATION_REGEX.sub("", text)
+    text = " ".join(text.split())
+    if text.startswith("the "):
+        text = text[4:]
+    return text
+
+
+def entity_rows(transcript) -> List[tuple]:
+    """``(normalized, entity_type, text, start, end, speaker)`` for every entity.
+
+    The speaker is the one whose utterance contains the entity's start time.
+    """
+    entities = getattr(transcript, "entities", None) or []
+    utterances = getattr(transcript, "utterances", None) or []
+    starts = [u.start for u in utterances]
+    rows = []
+    for entity in entities:
+        normalized = normalize_entity(entity.text or "")
+        if not normalized:
+            continue
+        speaker = None
+        index = bisect.bisect_right(starts, entity.start) - 1 if entity.start is not None else -1
+        if index >= 0 and entity.start <= utterances[index].end:
+            speaker = utterances[index].speaker
+        entity_type = getattr(entity.entity_type, "value", entity.entity_type)
+        rows.append((normalized, entity_type, entity.text, entity.start, entity.end, speaker))
+    return rows
+
+
+def transcript_segments(transcript) -> List[tuple]:
+    """Split a transcript into ``(speaker, start, end, text)`` rows to index."""
+    utterances = getattr(transcript, "utterances", None)
+    if utterances:
+        return [(u.speaker, u.start, u.end, u.text) for u in utterances]
+
+    words = getattr(transcript, "words", None)
+    if words:
+        rows = []
+        for i in range(0, len(words), WORDS_PER_CHUNK):
+            chunk = words[i:i + WORDS_PER_CHUNK]
+            rows.append((None, chunk[0].start, chunk[-1].end, " ".join(w.text for w in chunk)))
+        return rows
+
+    text = getattr(transcript, "text", None)
+    return [(None, None, None, text)] if text else []
+
+
+class TranscriptIndex:
+    """SQLite FTS5 index of transcript segments.
+
+    :param str path:
+        Database file; created on first use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions are begun explicitly, see add()
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL lets readers search while a transcript is being written
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(videos)")]
+            if "partial" not in columns:
+                # Indexes created before windows were indexed under their video
+                try:
+                    connection.execute("ALTER TABLE videos ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):  # another process added it first
+                        raise
+            self._local.connection = connection
+        return connection
+
+    def add(self, video_id: str, transcript, partial: bool = False):
+        """Index ``transcript`` under ``video_id``, replacing any earlier version.
+
+        ``partial`` marks a transcript of part of the video, which is skipped
+        if the whole video is indexed already.
+        """
+        rows = [(text, video_id, speaker, start, end)
+                for speaker, start, end, text in transcript_segments(transcript) if text]
+        entities = entity_rows(transcript)
+        connection = self._connection()
+        # Take the write lock up front: a deferred transaction would read MAX(rowid) first and
+        # then fail with SQLITE_BUSY, without waiting, if another process wrote in between
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            logger.error("dropped index write for %s: %s", video_id, e)
+            raise
+        try:
+            # Each video's segments occupy one contiguous rowid range, so replacing a
+            # transcript is a rowid range delete rather than a scan of the whole table
+            previous = connection.execute(
+                "SELECT first_rowid, last_rowid, partial FROM videos WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if partial and previous and not previous[2]:
+                connection.execute("ROLLBACK")
+                logger.info("kept the whole-video index of %s over a window", video_id)
+                return
+            if previous and previous[0] is not None:
+                connection.execute("DELETE FROM utterances WHERE rowid BETWEEN ? AND ?", previous[:2])
+            first_rowid = connection.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM utterances").fetchone()[0]
+            connection.executemany(
+                'INSERT INTO utterances (rowid, text, video_id, speaker, start, "end") VALUES (?, ?, ?, ?, ?, ?)',
+                [(first_rowid + i,) + row for i, row in enumerate(rows)],
+            )
+            connection.execute("DELETE FROM entities WHERE video_id = ?", (video_id,))
+            connection.executemany(
+                'INSERT INTO entities (normalized, entity_type, text, video_id, start, "end", speaker) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [row[:3] + (video_id,) + row[3:] for row in entities],
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO videos (video_id, indexed_at, first_rowid, last_rowid, partial) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (video_id, time.time(), first_rowid if rows else None, first_rowid + len(rows) - 1 if rows else None,
+                 int(partial)),
+            )
+            connection.execute("COMMIT")
+        except Exception as e:
+            connection.execute("ROLLBACK")
+            logger.error("dropped index write for %s: %s", video_id, e)
+            raise
+        logger.info("indexed %d segments and %d entities for %s", len(rows), len(entities), video_id)
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """Return the best matching segments for ``query``, best first.
+
+        :rtype: list
+        :returns:
+            dicts with ``video_id``, ``speaker``, ``start``, ``end``, ``text``,
+            a highlighted ``snippet`` and the bm25 ``score`` (lower is better).
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        rows = self._connection().execute(
+            """
+            SELECT video_id, speaker, start, "end", text,
+                   snippet(utterances, 0, '[', ']', '...', 12),
+                   bm25(utterances)
+            FROM utterances
+            WHERE utterances MATCH ?
+            ORDER BY bm25(utterances)
+            LIMIT ?
+            """,
+            (expression, limit),
+        ).fetchall()
+        return [
+            {
+                "video_id": video_id,
+                "speaker": speaker,
+                "start": start,
+                "end": end,
+                "text": text,
+                "snippet": snippet,
+                "score": score,
+            }
+            for video_id, speaker, start, end, text, snippet, score in rows
+        ]
+
+    def entity_mentions(self, text: str, entity_type: Optional[str] = None,
+                        limit: int = 20) -> List[dict]:
+        """Return the videos that mention an entity, most mentions first.
+
+        :param str text:
+            Entity as typed by the caller; it is normalized like indexed entities.
+        :param str entity_type:
+            Restrict to one type, e.g. ``organization``.
+        :param int limit:
+            Maximum number of videos returned.
+        :rtype: list
+        :returns:
+            One dict per video with ``video_id``, ``entity_type``, the spellings
+            seen (``names``) and every mention's ``start``/``end``/``speaker``.
+        """
+        normalized = normalize_entity(text)
+        if not normalized:
+            return []
+        # Videos are ranked from the index alone, and mentions are read only for the ones returned
+        query = "SELECT video_id, entity_type, COUNT(*) AS mentions FROM entities WHERE normalized = ?"
+        parameters = [normalized]
+        if entity_type:
+            query += " AND entity_type = ?"
+            parameters.append(entity_type)
+        query += " GROUP BY video_id, entity_type ORDER BY mentions DESC, video_id LIMIT ?"
+        parameters.append(limit)
+
+        connection = self._connection()
+        videos = []
+        for video_id, kind, _ in connection.execute(query, parameters).fetchall():
+            video = {"video_id": video_id, "entity_type": kind, "names": [], "mentions": []}
+            for name, start, end, speaker in connection.execute(
+                'SELECT text, start, "end", speaker FROM entities '
+                "WHERE normalized = ? AND entity_type = ? AND video_id = ? ORDER BY start",
+                (normalized, kind, video_id),
+            ):
+                if name not in video["names"]:
+                    video["names"].append(name)
+                video["mentions"].append({"start": start, "end": end, "speaker": speaker})
+            videos.append(video)
+        return videos
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
@@ -0,0 +1,251 @@
+"""
+This module contains the asynchronous AssemblyAI transcription client.
+
+``aai.Transcriber().transcribe`` blocks its thread for the whole job, polling
+at a fixed interval. :class:`TranscriptionClient` instead submits the job,
+parks the caller on a future and lets a single polling task per event loop
+check every outstanding job when it is due:
+
+(1) each job's finish time is estimated from the audio duration. The first
+    poll is made at ``first_poll_ratio`` of that estimate, and every later poll
+    after half the time left until it, but at most ``max_interval``, so polls
+    get denser as the job nears its likely finish. Only once a job runs past
+    its estimate does the interval back off again, up to ``max_interval``.
+(2) if a webhook URL is configured, AssemblyAI calls back when a job finishes.
+    The callback reaches whichever process the load balancer picks, not
+    necessarily the one waiting: :meth:`TranscriptionClient.notify` completes
+    the job if it waits in this process, and otherwise records the callback
+    in the :class:`shared.SharedCache`, where the waiting process's poller
+    finds it within ``webhook_check_interval``. The webhook therefore only
+    helps processes that share that cache, i.e. ``WORKERS=N`` on one host; on
+    Lambda callbacks land in another container and jobs finish by polling.
+    Polling continues on the schedule of (1) either way, so a lost or
+    misrouted callback never delays a job beyond what polling alone would.
+
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import assemblyai as aai
+
+from shared import SharedCache
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_AUTH_HEADER = "X-Webhook-Secret"
+
+FINISHED_STATUSES = (aai.TranscriptStatus.completed, aai.TranscriptStatus.error)
+
+# Seconds a callback for a job waited on by another process is kept in the shared cache
+WEBHOOK_RECORD_TTL = 3600
+
+# Estimated processing time: a fixed queueing overhead plus a fraction of the audio duration
+EXPECTED_OVERHEAD = 5.0
+EXPECTED_RATIO = 0.1
+
+
+class PendingJob:
+    """Polling state for one submitted transcript."""
+
+    def __init__(self, future: asyncio.Future, next_poll: float, expected_at: float, interval: float):
+        self.future = future
+        self.next_poll = next_poll
+        self.expected_at = expected_at  # loop time the job is estimated to finish
+        self.interval = interval  # backoff once the estimate has passed
+        self.failures = 0
+
+
+class TranscriptionClient:
+    """Submit transcripts and wait for them without holding a thread.
+
+    :param str webhook_url:
+        Public URL of the webhook route, or ``None`` to rely on polling only.
+    :param str webhook_secret:
+        Value AssemblyAI sends back in ``X-Webhook-Secret`` with each callback.
+        Required with ``webhook_url``: without it the webhook is not used,
+        since anyone could then complete jobs by calling the route.
+    :param float first_poll_ratio:
+        Fraction of a job's estimated processing time after which it is first
+        polled. A poll is one cheap GET, so the default of 0.1 polls early: a
+        job finishing before its first poll waits at most a tenth of its
+        estimate, e.g. 108 s for three hours of audio, and one finishing later
+        at most ``max_interval``.
+    :param float min_interval:
+        Shortest gap between two polls of the same job, in seconds.
+    :param float max_interval:
+        Longest gap between two polls of the same job, in seconds.
+    :param SharedCache shared:
+        Cache shared with the other worker processes, through which callbacks
+        for their jobs are passed on.
+    :param float webhook_check_interval:
+        How often the shared cache is checked for callbacks, in seconds.
+    :param int max_poll_failures:
+        Consecutive failed polls after which a job is failed.
+    """
+
+    def __init__(self, webhook_url: Optional[str] = None, webhook_secret: Optional[str] = None,
+                 first_poll_ratio: float = 0.1, min_interval: float = 3.0, max_interval: float = 60.0,
+                 shared: Optional[SharedCache] = None, webhook_check_interval: float = 1.0,
+                 max_poll_failures: int = 5):
+        if webhook_url and not webhook_secret:
+            logger.warning("a webhook URL is set without a webhook secret; polling for transcripts instead")
+            webhook_url = None
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.first_poll_ratio = first_poll_ratio
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.shared = shared
+        self.webhook_check_interval = webhook_check_interval
+        self.max_poll_failures = max_poll_failures
+        self._jobs: Dict[str, PendingJob] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def poll_schedule(self, duration: Optional[float]) -> Tuple[float, float]:
+        """Return the delay before the first poll and the estimated processing time.
+
+        :param float duration:
+            Audio duration in seconds, or ``None`` if unknown.
+        """
+        expected = EXPECTED_OVERHEAD + EXPECTED_RATIO * (duration or 0)
+        return max(self.min_interval, self.first_poll_ratio * expected), expected
+
+    def next_interval(self, job: PendingJob, now: float) -> float:
+        """Gap before the next poll of an unfinished job."""
+        remaining = job.expected_at - now
+        if remaining > self.min_interval:
+            return min(self.max_interval, max(self.min_interval, remaining / 2))
+        interval = job.interval
+        job.interval = min(self.max_interval, job.interval * 1.5)
+        return interval
+
+    async def submit(self, audio, config: Optional[aai.TranscriptionConfig] = None) -> aai.Transcript:
+        """Upload (if ``audio`` is a local file) and queue a transcript without waiting for it."""
+        config = config or aai.TranscriptionConfig()
+        if self.webhook_url:
+            config.set_webhook(self.webhook_url, WEBHOOK_AUTH_HEADER, self.webhook_secret)
+        return await asyncio.to_thread(aai.Transcriber().submit, audio, config)
+
+    async def transcribe(self, audio, config: Optional[aai.TranscriptionConfig] = None,
+                         duration: Optional[float] = None) -> aai.Transcript:
+        """Submit ``audio`` and wait for the finished transcript.
+
+        :param audio:
+            Local file path or URL of the audio.
+        :param config:
+            Transcription options.
+        :param float duration:
+            Audio duration in seconds, used to schedule polls.
+        :rtype: aai.Transcript
+        :returns:
+            The transcript in its final state, ``completed`` or ``error``.
+        """
+        transcript = await self.submit(audio, config)
+        return await self.wait(transcript.id, duration)
+
+    async def wait(self, transcript_id: str, duration: Optional[float] = None) -> aai.Transcript:
+        """Wait for an already submitted transcript to finish."""
+        loop = asyncio.get_running_loop()
+        job = self._jobs.get(transcript_id)
+        if job is None:
+            now = loop.time()
+            first_delay, expected = self.poll_schedule(duration)
+            job = PendingJob(loop.create_future(), now + first_delay, now + expected, self.min_interval)
+            self._jobs[transcript_id] = job
+            self._ensure_poller()
+        try:
+            return await asyncio.shield(job.future)
+        finally:
+            if job.future.done():
+                self._jobs.pop(transcript_id, None)
+
+    async def notify(self, transcript_id: str) -> bool:
+        """Complete a job after its webhook callback arrived.
+
+        A job waited on by another process is recorded in the shared cache
+        for that process's poller.
+
+        :rtype: bool
+        :returns:
+            ``False`` if the job is not waited on in this process and there is
+            no shared cache to pass the callback on through.
+        """
+        job = self._jobs.get(transcript_id)
+        if job is not None:
+            await self._poll(transcript_id, job)
+            return True
+        if self.shared is None:
+            return False
+        try:
+            await asyncio.to_thread(self.shared.put, "webhook", transcript_id, True, WEBHOOK_RECORD_TTL)
+        except Exception as e:
+            logger.warning("recording the callback for %s failed: %s", transcript_id, e)
+            return False
+        return True
+
+    def _watches_callbacks(self) -> bool:
+        return bool(self.webhook_url) and self.shared is not None
+
+    def _called_back(self, transcript_ids: List[str]) -> List[str]:
+        """The jobs among ``transcript_ids`` whose callback reached another process."""
+        try:
+            return [tid for tid in transcript_ids if self.shared.get("webhook", tid)]
+        except Exception as e:
+            logger.warning("checking shared callbacks failed: %s", e)
+            return []
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._poller = loop.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            if self._watches_callbacks():
+                for tid in await asyncio.to_thread(self._called_back, list(self._jobs)):
+                    if tid in self._jobs:
+                        self._jobs[tid].next_poll = loop.time()
+            now = loop.time()
+            due = [(tid, job) for tid, job in self._jobs.items() if job.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll(tid, job) for tid, job in due))
+            if not self._jobs:
+                break
+            timeout = max(0.0, min(job.next_poll for job in self._jobs.values()) - loop.time())
+            if self._watches_callbacks():
+                timeout = min(timeout, self.webhook_check_interval)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, transcript_id: str, job: PendingJob):
+        loop = asyncio.get_running_loop()
+        try:
+            transcript = await asyncio.to_thread(aai.Transcript.get_by_id, transcript_id)
+        except Exception as e:
+            job.failures += 1
+            logger.warning("polling transcript %s failed (%d): %s", transcript_id, job.failures, e)
+            if job.failures >= self.max_poll_failures:
+                self._jobs.pop(transcript_id, None)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                job.next_poll = loop.time() + job.interval
+            return
+
+        job.failures = 0
+        if transcript.status in FINISHED_STATUSES:
+            self._jobs.pop(transcript_id, None)
+            if not job.future.done():
+                job.future.set_result(transcript)
+        else:
+            now = loop.time()
+            job.next_poll = now + self.next_interval(job, now)